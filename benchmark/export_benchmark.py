@@ -0,0 +1,390 @@
+'''
+
+  V-Ray/Blender
+
+  http://vray.cgdo.ru
+
+  Author: Andrey M. Izrantsev (aka bdancer)
+  E-Mail: izrantsev@cgdo.ru
+
+  This program is free software; you can redistribute it and/or
+  modify it under the terms of the GNU General Public License
+  as published by the Free Software Foundation; either version 2
+  of the License, or (at your option) any later version.
+
+  This program is distributed in the hope that it will be useful,
+  but WITHOUT ANY WARRANTY; without even the implied warranty of
+  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+  GNU General Public License for more details.
+
+  You should have received a copy of the GNU General Public License
+  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+  All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+
+'''
+
+
+# Export pipeline benchmark.
+#
+# Builds parametric scenes in an empty Blender session, exports them with
+# the export profiler enabled and compares stage timings with a stored
+# baseline. The add-on folder must be named "vb25".
+#
+# Usage:
+#   blender --background --factory-startup --python benchmark/export_benchmark.py -- [options]
+#
+# Options:
+#   --cases NAME[,NAME]   Cases to run (default: all)
+#   --scale FLOAT         Multiplier for scene sizes (default: 1.0)
+#   --repeat N            Runs per case; the fastest one is used (default: 3)
+#   --baseline FILE       Compare with baseline timings
+#   --save-baseline FILE  Store timings as a new baseline
+#   --tolerance FLOAT     Allowed slowdown against baseline (default: 0.2)
+#   --report FILE         Write all timings as JSON
+#
+# Exits with code 1 if any stage is slower than the baseline allows.
+
+
+''' Python modules '''
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+''' Blender modules '''
+import bpy
+
+''' vb modules '''
+ADDON_PARENT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if ADDON_PARENT_DIR not in sys.path:
+	sys.path.insert(0, ADDON_PARENT_DIR)
+
+import vb25
+
+try:
+	import addon_utils
+	addon_utils.enable('vb25', default_set=True)
+except Exception:
+	vb25.register()
+
+import vb25.render
+import vb25.proxy
+
+from vb25.lib import VRayProxy
+from vb25.plugins import PLUGINS
+
+
+# Fixed seed for reproducible scenes
+SEED = 1234
+
+
+'''
+  SCENE GENERATORS
+'''
+def clear_scene(scene):
+	for ob in list(scene.objects):
+		scene.objects.unlink(ob)
+	for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.cameras, bpy.data.lamps, bpy.data.materials, bpy.data.textures, bpy.data.particles):
+		for item in list(collection):
+			if item.users == 0:
+				collection.remove(item)
+
+
+# Grid with polys quads
+def new_grid_mesh(name, polys):
+	side = max(1, int(math.sqrt(polys)))
+
+	verts = [(x / side, y / side, 0.0) for y in range(side + 1) for x in range(side + 1)]
+	faces = []
+	for y in range(side):
+		for x in range(side):
+			i = y * (side + 1) + x
+			faces.append((i, i + 1, i + side + 2, i + side + 1))
+
+	me = bpy.data.meshes.new(name)
+	me.from_pydata(verts, [], faces)
+	me.update()
+	return me
+
+
+def new_object(scene, name, data, location=(0.0, 0.0, 0.0)):
+	ob = bpy.data.objects.new(name, data)
+	ob.location = location
+	scene.objects.link(ob)
+	return ob
+
+
+def new_material(name, textures=0):
+	ma = bpy.data.materials.new(name)
+	ma.diffuse_color = (random.random(), random.random(), random.random())
+
+	for i in range(textures):
+		try:
+			tex = bpy.data.textures.new("%sTE%i" % (name, i), type='VRAY')
+			tex.vray.type = 'TexChecker' if i % 2 else 'TexNoiseMax'
+		except (TypeError, AttributeError):
+			# Stock Blender build: use image textures
+			tex = bpy.data.textures.new("%sTE%i" % (name, i), type='IMAGE')
+			tex.image = get_benchmark_image()
+
+		slot = ma.texture_slots.add()
+		slot.texture = tex
+		slot.diffuse_color_factor = 1.0 / textures
+	return ma
+
+
+BENCHMARK_IMAGE = None
+
+def get_benchmark_image():
+	global BENCHMARK_IMAGE
+	if BENCHMARK_IMAGE is None:
+		BENCHMARK_IMAGE = bpy.data.images.new("benchmark", 256, 256)
+		BENCHMARK_IMAGE.filepath_raw = os.path.join(tempfile.gettempdir(), "vb25_benchmark.png")
+		BENCHMARK_IMAGE.file_format = 'PNG'
+		BENCHMARK_IMAGE.save()
+	return BENCHMARK_IMAGE
+
+
+def build_meshes(scene, scale):
+	count = int(200 * scale)
+	for i in range(count):
+		me = new_grid_mesh("ME%i" % i, 2000)
+		ob = new_object(scene, "OB%i" % i, me, (i % 20, i // 20, 0.0))
+		ob.data.materials.append(new_material("MA%i" % i))
+
+
+def build_lamps(scene, scale):
+	build_single_mesh(scene)
+	for i in range(int(100 * scale)):
+		la = bpy.data.lamps.new("LA%i" % i, 'POINT')
+		new_object(scene, "LA%i" % i, la, (random.uniform(-10, 10), random.uniform(-10, 10), 5.0))
+
+
+def build_single_mesh(scene):
+	ob = new_object(scene, "Ground", new_grid_mesh("Ground", 100))
+	ob.data.materials.append(new_material("Ground"))
+	return ob
+
+
+# Tree mesh duplicated on vertices of an emitter
+def build_dupli_forest(scene, scale):
+	tree = new_object(scene, "Tree", new_grid_mesh("Tree", 500))
+	tree.data.materials.append(new_material("Bark", textures=2))
+
+	emitter = new_object(scene, "Forest", new_grid_mesh("Forest", int(20000 * scale)))
+	emitter.dupli_type = 'VERTS'
+	tree.parent = emitter
+
+
+def build_hair(scene, scale):
+	ob = build_single_mesh(scene)
+	ob.modifiers.new("Hair", 'PARTICLE_SYSTEM')
+	settings = ob.particle_systems[0].settings
+	settings.type        = 'HAIR'
+	settings.count       = int(20000 * scale)
+	settings.hair_step   = 5
+	settings.render_type = 'PATH'
+	scene.vray.exporter.use_hair = True
+
+
+def build_texture_stacks(scene, scale):
+	for i in range(int(50 * scale)):
+		ob = new_object(scene, "OB%i" % i, new_grid_mesh("ME%i" % i, 100), (i, 0.0, 0.0))
+		ob.data.materials.append(new_material("MA%i" % i, textures=8))
+
+
+def build_animation(scene, scale):
+	build_meshes(scene, scale * 0.25)
+
+	scene.frame_start = 1
+	scene.frame_end   = 10
+	for i,ob in enumerate(scene.objects):
+		if ob.type != 'MESH' or i % 2:
+			continue
+		for frame in (scene.frame_start, scene.frame_end):
+			ob.location.z = frame * 0.1
+			ob.keyframe_insert('location', frame=frame)
+
+	VRayExporter = scene.vray.exporter
+	VRayExporter.animation      = True
+	VRayExporter.animation_type = 'FULL'
+
+
+CASES = (
+	('meshes',    build_meshes),
+	('lamps',     build_lamps),
+	('dupli',     build_dupli_forest),
+	('hair',      build_hair),
+	('textures',  build_texture_stacks),
+	('animation', build_animation),
+)
+
+
+'''
+  BENCHMARK
+'''
+def setup_exporter(scene, output_dir):
+	VRayExporter = scene.vray.exporter
+	VRayExporter.output       = 'USER'
+	VRayExporter.output_dir   = output_dir
+	VRayExporter.auto_meshes  = True
+	VRayExporter.autorun      = False
+	VRayExporter.use_profiler = True
+	VRayExporter.debug        = False
+	VRayExporter.animation    = False
+
+	# Export needs the scene camera and clear_scene() removes it
+	camera = new_object(scene, "Camera", bpy.data.cameras.new("Camera"), (0.0, -20.0, 15.0))
+	camera.rotation_euler = (math.radians(60.0), 0.0, 0.0)
+	scene.camera = camera
+
+
+# Returns { stage : seconds }
+def run_export(scene):
+	bus = vb25.render.init_bus(None, scene)
+
+	profiler = bus['profiler']
+	profiler.patchPlugins(PLUGINS)
+	try:
+		vb25.render.write_scene(bus)
+	finally:
+		profiler.restore()
+
+	vb25.render.close_files(bus)
+	vb25.render.write_profile(bus)
+
+	report = profiler.getReport()
+
+	timings = {'total' : report['total']}
+	for item in report.get('stage', []):
+		timings[item['name']] = item['seconds']
+	timings['output_mb'] = sum([f['bytes'] for f in report['files']]) / (1024.0 * 1024.0)
+	return timings
+
+
+# Writes the first mesh object as VRayProxy with the 'PYTHON' writer
+# used by "Create proxy" operator and loads its preview
+def run_proxy(scene, output_dir):
+	ob = [ob for ob in scene.objects if ob.type == 'MESH'][0]
+
+	filepath = os.path.join(output_dir, "benchmark.vrmesh")
+
+	timings = {}
+
+	t = time.time()
+	vb25.proxy.write_vrmesh(scene, ob, filepath)
+	timings['proxy_write'] = time.time() - t
+
+	t = time.time()
+	meshFile = VRayProxy.MeshFile(filepath)
+	meshFile.getPreviewMesh('0', 0, 1.0)
+	meshFile.close()
+	timings['proxy_read'] = time.time() - t
+
+	return timings
+
+
+def run_case(name, build, scale, repeat):
+	random.seed(SEED)
+
+	scene = bpy.context.scene
+	clear_scene(scene)
+
+	output_dir = tempfile.mkdtemp(prefix="vb25_benchmark_")
+	try:
+		setup_exporter(scene, output_dir)
+		build(scene, scale)
+
+		best = {}
+		for i in range(repeat):
+			timings = run_export(scene)
+			if name == 'meshes':
+				timings.update(run_proxy(scene, output_dir))
+			for stage, value in timings.items():
+				if stage == 'output_mb':
+					best[stage] = value
+				else:
+					best[stage] = min(best.get(stage, value), value)
+		return best
+	finally:
+		shutil.rmtree(output_dir, ignore_errors=True)
+
+
+# Returns list of regression descriptions
+def compare(results, baseline, tolerance):
+	regressions = []
+	for case in sorted(results):
+		for stage in sorted(results[case]):
+			if stage == 'output_mb':
+				continue
+			base = baseline.get(case, {}).get(stage)
+			if not base:
+				continue
+			value = results[case][stage]
+			if value > base * (1.0 + tolerance):
+				regressions.append("%s/%s: %.3f s (baseline %.3f s, +%.0f%%)" % (case, stage, value, base, (value / base - 1.0) * 100.0))
+	return regressions
+
+
+def get_args():
+	argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+	parser = argparse.ArgumentParser(description="V-Ray/Blender export benchmark")
+	parser.add_argument('--cases',         default=",".join([name for name, build in CASES]))
+	parser.add_argument('--scale',         type=float, default=1.0)
+	parser.add_argument('--repeat',        type=int,   default=3)
+	parser.add_argument('--baseline',      default=None)
+	parser.add_argument('--save-baseline', default=None)
+	parser.add_argument('--tolerance',     type=float, default=0.2)
+	parser.add_argument('--report',        default=None)
+	return parser.parse_args(argv)
+
+
+def main():
+	args = get_args()
+
+	cases   = dict(CASES)
+	results = {}
+
+	for name in args.cases.split(","):
+		if name not in cases:
+			print("Unknown case: %s" % name)
+			continue
+
+		results[name] = run_case(name, cases[name], args.scale, args.repeat)
+
+		print("%s:" % name)
+		for stage in sorted(results[name]):
+			print("  %-12s %10.3f" % (stage, results[name][stage]))
+
+	if args.report:
+		with open(args.report, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+
+	if args.save_baseline:
+		with open(args.save_baseline, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+		print("Baseline saved: %s" % args.save_baseline)
+
+	if args.baseline:
+		with open(args.baseline, 'r') as f:
+			baseline = json.load(f)
+
+		regressions = compare(results, baseline, args.tolerance)
+		if regressions:
+			print("Regressions:")
+			for regression in regressions:
+				print("  %s" % regression)
+			sys.exit(1)
+
+		print("No regressions")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,186 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+# Removes unchanged parameters from the plugin blocks of animation frames.
+#
+# Every frame of the animation is exported as a full set of plugin blocks
+# with "interpolate((frame, value))" parameters. The filter remembers the
+# last value of every plugin parameter and drops keys that repeat it.
+# When a value changes after being held for some frames, the key of the
+# last held frame is written too, so V-Ray doesn't interpolate over the
+# held range. Blocks left without parameters are dropped entirely.
+#
+# Values are compared by hash. A value is kept only while it's held, to
+# write the key of the last held frame; long values (like hex encoded
+# lists) are kept in a temporary file.
+#
+# Text the filter doesn't understand is passed through unchanged.
+
+# Python modules
+import hashlib
+import re
+import tempfile
+
+
+# Held values longer than this are kept in a temporary file
+MAX_MEMORY_VALUE = 4096
+
+# Block with the blank line before it and the line break after it
+PLUGIN_RE      = re.compile(r'(?:^[ \t]*\n)?^([A-Za-z_]\w*)[ \t]+([A-Za-z_]\w*)[ \t]*\{[^\n]*\n(.*?)^\}[ \t]*(?:\n|$)', re.M | re.S)
+PARAM_RE       = re.compile(r'[ \t]*([A-Za-z_]\w*)[ \t]*=[ \t]*(.*?);[ \t]*(?:\n|$)', re.S)
+EMPTY_RE       = re.compile(r'(?:[ \t]*(?://[^\n]*)?\n)*')
+INTERPOLATE_RE = re.compile(r'interpolate\(\((-?\d+),\s*(.*)\)\)$', re.S)
+
+
+def getDigest(value):
+    return hashlib.sha1(value.encode('utf-8')).digest()
+
+
+class AnimationFilter():
+    # (pluginName, paramName) -> [digest, heldFrame, writtenFrame, heldValue]
+    values = None
+
+    # Temporary file for long held values
+    heldFile = None
+
+    # Plugin type -> number of blocks dropped by the last process() call
+    blocksDropped = None
+
+    # Statistics
+    keysWritten = None
+    keysSkipped = None
+
+    def __init__(self):
+        self.values = {}
+
+        self.blocksDropped = {}
+
+        self.keysWritten = 0
+        self.keysSkipped = 0
+
+    def close(self):
+        if self.heldFile is not None:
+            self.heldFile.close()
+            self.heldFile = None
+
+    # Returns value or its (offset, size) in the temporary file
+    def storeValue(self, value):
+        if len(value) <= MAX_MEMORY_VALUE:
+            return value
+        if self.heldFile is None:
+            self.heldFile = tempfile.TemporaryFile()
+        data = value.encode('utf-8')
+        self.heldFile.seek(0, 2)
+        offset = self.heldFile.tell()
+        self.heldFile.write(data)
+        return (offset, len(data))
+
+    def loadValue(self, stored):
+        if type(stored) is str:
+            return stored
+        offset, size = stored
+        self.heldFile.seek(offset)
+        return self.heldFile.read(size).decode('utf-8')
+
+    # Returns parsed block parameters or None if the block is not understood
+    def parseParams(self, body):
+        params = []
+        pos = 0
+        while pos < len(body):
+            empty = EMPTY_RE.match(body, pos)
+            if empty.end() == len(body):
+                break
+            m = PARAM_RE.match(body, empty.end())
+            if not m:
+                return None
+            params.append((m.group(1), m.group(2), m.group(0)))
+            pos = m.end()
+        return params
+
+    def filterParam(self, pluginName, paramName, value):
+        key = (pluginName, paramName)
+        prev = self.values.get(key)
+
+        m = INTERPOLATE_RE.match(value)
+        if not m:
+            digest = getDigest(value)
+            if prev is not None and prev[0] == digest:
+                self.keysSkipped += 1
+                return None
+            self.values[key] = [digest, None, None, None]
+            self.keysWritten += 1
+            return value
+
+        frame = int(m.group(1))
+        frameValue = m.group(2)
+        digest = getDigest(frameValue)
+
+        if prev is not None and prev[0] == digest:
+            if prev[3] is None:
+                prev[3] = self.storeValue(frameValue)
+            prev[1] = frame
+            self.keysSkipped += 1
+            return None
+
+        self.values[key] = [digest, frame, frame, None]
+        self.keysWritten += 1
+
+        if prev is not None and prev[1] is not None and prev[1] != prev[2]:
+            self.keysWritten += 1
+            return "interpolate((%i,%s),(%i,%s))" % (prev[1], self.loadValue(prev[3]), frame, frameValue)
+
+        return value
+
+    def filterBlock(self, match):
+        pluginType, pluginName, body = match.groups()
+
+        params = self.parseParams(body)
+        if params is None:
+            return match.group(0)
+
+        known = any(((pluginName, paramName) in self.values for paramName, value, text in params))
+
+        block = []
+        for paramName, value, text in params:
+            newValue = self.filterParam(pluginName, paramName, value)
+            if newValue is None:
+                continue
+            if newValue is value:
+                block.append(text.rstrip("\n") + "\n")
+            else:
+                block.append("\t%s=%s;\n" % (paramName, newValue))
+
+        if not block and known:
+            self.blocksDropped[pluginType] = self.blocksDropped.get(pluginType, 0) + 1
+            return ""
+
+        header = match.group(0)[:match.start(3) - match.start(0)]
+        footer = match.group(0)[match.end(3) - match.start(0):]
+
+        return "%s%s%s" % (header, "".join(block), footer)
+
+    # Returns frame text with unchanged parameters removed
+    def process(self, text):
+        self.blocksDropped = {}
+        return PLUGIN_RE.sub(self.filterBlock, text)
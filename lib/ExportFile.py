@@ -0,0 +1,121 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+
+# Buffered .vrscene output.
+#
+# Exporters write a lot of small strings; they are collected in memory
+# and passed to the underlying file in large chunks. The target could be
+# an open file or any object with write() (like io.StringIO).
+#
+# writePlugin() is the common way to write a plugin block; it also
+# counts written plugins by type.
+
+# Python modules
+import io
+
+
+# Collected data is written when it's larger than this
+BUFFER_SIZE = 1024 * 1024
+
+
+class ExportFile():
+    sink       = None
+    bufferSize = None
+
+    chunks = None
+    size   = None
+
+    # Plugin type -> number of written blocks
+    plugins = None
+
+    # Total number of characters written
+    written = None
+
+    def __init__(self, sink=None, bufferSize=BUFFER_SIZE):
+        self.sink       = io.StringIO() if sink is None else sink
+        self.bufferSize = bufferSize
+
+        self.chunks  = []
+        self.size    = 0
+        self.plugins = {}
+        self.written = 0
+
+    @property
+    def name(self):
+        return getattr(self.sink, 'name', None)
+
+    @property
+    def closed(self):
+        return getattr(self.sink, 'closed', False)
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size    += len(data)
+        self.written += len(data)
+        if self.size >= self.bufferSize:
+            self.writeChunks()
+
+    def writeChunks(self):
+        if self.chunks:
+            self.sink.write("".join(self.chunks))
+            self.chunks = []
+            self.size   = 0
+
+    # 'params' is a sequence of (name, value) pairs with already
+    # formatted values
+    def writePlugin(self, pluginType, pluginName, params, comment=None):
+        block = ["\n%s %s {" % (pluginType, pluginName)]
+        if comment:
+            block.append(" // %s" % comment)
+        for param, value in params:
+            block.append("\n\t%s=%s;" % (param, value))
+        block.append("\n}\n")
+
+        self.write("".join(block))
+
+        self.plugins[pluginType] = self.plugins.get(pluginType, 0) + 1
+
+    # Adds plugin counts of blocks passed to write(), like data of
+    # another ExportFile; 'dropped' counts are subtracted
+    def addPlugins(self, plugins, dropped=None):
+        for pluginType, count in plugins.items():
+            if dropped:
+                count -= dropped.get(pluginType, 0)
+            if count > 0:
+                self.plugins[pluginType] = self.plugins.get(pluginType, 0) + count
+
+    def flush(self):
+        self.writeChunks()
+        if hasattr(self.sink, 'flush'):
+            self.sink.flush()
+
+    # Contents of the in-memory sink
+    def getvalue(self):
+        self.flush()
+        return self.sink.getvalue()
+
+    def close(self):
+        self.flush()
+        self.sink.close()
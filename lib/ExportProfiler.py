@@ -0,0 +1,205 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+
+# Export profiler.
+#
+# Collects wall time, call count and emitted characters per category
+# and key (plugin type, object, export stage), cache hit rates and
+# output file sizes. Times and sizes of nested calls are inclusive.
+
+# Python modules
+import contextlib
+import json
+import os
+import time
+
+
+# Summary of the last export for the UI
+LastSummary = []
+
+
+class NoMeasure():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NO_MEASURE = NoMeasure()
+
+
+# Returns context measuring the block or doing nothing without profiler
+def measure(profiler, category, key):
+    if profiler is None:
+        return NO_MEASURE
+    return profiler.measure(category, key)
+
+
+class ExportProfiler():
+    # Callable returning total number of emitted characters
+    getWritten = None
+
+    # category -> key -> [calls, seconds, characters]
+    entries = None
+
+    # name -> [hits, misses]
+    caches = None
+
+    # filepath -> bytes
+    files = None
+
+    # (module, original function)
+    patched = None
+
+    def __init__(self, getWritten=None):
+        self.getWritten = getWritten
+
+        self.entries = {}
+        self.caches  = {}
+        self.files   = {}
+        self.patched = []
+
+        self.startTime = time.time()
+
+
+    def written(self):
+        return self.getWritten() if self.getWritten else 0
+
+
+    def add(self, category, key, seconds, characters=0, calls=1):
+        entry = self.entries.setdefault(category, {}).setdefault(key, [0, 0.0, 0])
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += characters
+
+
+    @contextlib.contextmanager
+    def measure(self, category, key):
+        written = self.written()
+        start   = time.time()
+        try:
+            yield
+        finally:
+            self.add(category, key, time.time() - start, self.written() - written)
+
+
+    def wrap(self, category, key, function):
+        def wrapper(*args, **kwargs):
+            with self.measure(category, key):
+                return function(*args, **kwargs)
+        wrapper.__wrapped__ = function
+        return wrapper
+
+
+    # Wraps write() of every plugin module:
+    # plugins is { plugin type : { plugin id : module } }
+    def patchPlugins(self, plugins):
+        for pluginType in plugins:
+            for pluginID, module in plugins[pluginType].items():
+                function = getattr(module, 'write', None)
+                if not callable(function):
+                    continue
+                self.patched.append((module, function))
+                module.write = self.wrap('plugin', "%s.%s" % (pluginType, pluginID), function)
+
+
+    def restore(self):
+        for module, function in reversed(self.patched):
+            module.write = function
+        self.patched = []
+
+
+    # Accumulates statistics of objects with 'hits' and 'misses'
+    def addCaches(self, caches):
+        for name, cache in caches.items():
+            entry = self.caches.setdefault(name, [0, 0])
+            entry[0] += cache.hits
+            entry[1] += cache.misses
+
+
+    def addFile(self, filepath):
+        try:
+            self.files[filepath] = os.path.getsize(filepath)
+        except OSError:
+            pass
+
+
+    def getReport(self):
+        report = {
+            'total' : time.time() - self.startTime,
+        }
+
+        for category in sorted(self.entries):
+            items = self.entries[category]
+            report[category] = [
+                {
+                    'name'       : key,
+                    'calls'      : items[key][0],
+                    'seconds'    : items[key][1],
+                    'characters' : items[key][2],
+                }
+                for key in sorted(items, key=lambda k: items[k][1], reverse=True)
+            ]
+
+        report['caches'] = [
+            {
+                'name'     : name,
+                'hits'     : hits,
+                'misses'   : misses,
+                'hit_rate' : hits / (hits + misses) if hits + misses else 0.0,
+            }
+            for name, (hits, misses) in sorted(self.caches.items())
+        ]
+
+        report['files'] = [{'name': filepath, 'bytes': size} for filepath, size in sorted(self.files.items())]
+
+        return report
+
+
+    def writeReport(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.getReport(), f, indent=1)
+
+
+    # Returns short text lines: total time and slowest plugins and objects
+    def getSummary(self, count=5):
+        report  = self.getReport()
+        summary = ["Export: %.2f s, output %.1f MB" % (report['total'], sum(self.files.values()) / (1024.0 * 1024.0))]
+
+        for category in ('stage', 'plugin', 'object'):
+            for item in report.get(category, [])[:count]:
+                summary.append("%s: %.2f s, %i calls, %.1f MB" % (item['name'], item['seconds'], item['calls'], item['characters'] / (1024.0 * 1024.0)))
+
+        for item in report['caches']:
+            if item['hits'] + item['misses']:
+                summary.append("Cache %s: %.0f%% hits" % (item['name'], item['hit_rate'] * 100.0))
+
+        return summary
+
+
+    def publish(self):
+        global LastSummary
+        LastSummary = self.getSummary()
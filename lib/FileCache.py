@@ -0,0 +1,155 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+# Persistent key -> bytes storage with LRU eviction by total size.
+# Every entry is a separate file named by the key; file modification
+# time is used as the last access time.
+
+# Python modules
+import os
+import threading
+import time
+
+
+class FileCache():
+    dirpath = None
+    maxSize = None
+
+    # key -> [size, last access time]
+    entries = None
+    size    = None
+
+    # Statistics
+    hits   = None
+    misses = None
+
+    def __init__(self, dirpath, maxSize):
+        self.dirpath = dirpath
+        self.maxSize = maxSize
+
+        self.lock = threading.Lock()
+
+        self.entries = {}
+        self.size    = 0
+
+        self.hits   = 0
+        self.misses = 0
+
+        if not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+
+        for filename in os.listdir(self.dirpath):
+            if filename.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dirpath, filename))
+            except OSError:
+                continue
+            self.entries[filename] = [st.st_size, st.st_mtime]
+            self.size += st.st_size
+
+
+    def getFilepath(self, key):
+        return os.path.join(self.dirpath, key)
+
+
+    def get(self, key):
+        filepath = self.getFilepath(key)
+
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            os.utime(filepath, None)
+        except OSError:
+            # Removed by other session
+            with self.lock:
+                self.remove(key)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries[key][1] = time.time()
+            self.hits += 1
+
+        return data
+
+
+    def put(self, key, data):
+        if len(data) > self.maxSize:
+            return
+
+        filepath = self.getFilepath(key)
+        tmpFilepath = "%s.%i.tmp" % (filepath, threading.get_ident())
+
+        try:
+            with open(tmpFilepath, 'wb') as f:
+                f.write(data)
+            os.replace(tmpFilepath, filepath)
+        except OSError:
+            return
+
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = [len(data), time.time()]
+            self.size += len(data)
+            self.evict()
+
+
+    # Must be called with the lock acquired
+    def remove(self, key):
+        if key in self.entries:
+            self.size -= self.entries[key][0]
+            del self.entries[key]
+
+
+    # Must be called with the lock acquired
+    def evict(self):
+        if self.size <= self.maxSize:
+            return
+
+        for key in sorted(self.entries, key=lambda k: self.entries[k][1]):
+            try:
+                os.remove(self.getFilepath(key))
+            except OSError:
+                pass
+            self.remove(key)
+
+            if self.size <= self.maxSize:
+                break
+
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                try:
+                    os.remove(self.getFilepath(key))
+                except OSError:
+                    pass
+                self.remove(key)
@@ -0,0 +1,220 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+
+# Persistent plugin name index for referenced .vrscene / .vrmat files.
+# Files are indexed once and the index is stored in the cache directory
+# keyed by file path; an entry is valid while file size and modification
+# time match.
+
+# Python modules
+import hashlib
+import json
+import os
+import threading
+
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+from . import VRaySceneParser
+
+
+INDEX_VERSION = 1
+
+# .vrmat assets are not mapped to file offsets
+NO_OFFSET = -1
+
+
+def getFileKey(filepath):
+    st = os.stat(filepath)
+    return (st.st_size, st.st_mtime)
+
+
+# Returns { type : [(name, offset), ...] }
+def indexVrscene(filepath):
+    plugins = {}
+    for pluginInfo in VRaySceneParser.IterPlugins(filepath):
+        plugins.setdefault(pluginInfo.type, []).append((pluginInfo.name, pluginInfo.offset))
+    return plugins
+
+
+def indexVrmat(filepath):
+    xmldoc = minidom.parse(filepath)
+
+    plugins = {}
+    for item in xmldoc.getElementsByTagName('Asset'):
+        url = str(item.attributes['url'].value)
+        if url.startswith("/"):
+            url = url[1:]
+        plugins.setdefault(item.attributes['type'].value, []).append((url, NO_OFFSET))
+    return plugins
+
+
+class PluginIndex():
+    dirpath = None
+
+    # filepath -> (fileKey, plugins)
+    entries = None
+
+    # Statistics
+    hits   = None
+    misses = None
+
+    def __init__(self, dirpath=None):
+        self.dirpath = dirpath
+
+        self.lock = threading.Lock()
+
+        self.entries = {}
+
+        self.hits   = 0
+        self.misses = 0
+
+        if self.dirpath and not os.path.exists(self.dirpath):
+            os.makedirs(self.dirpath)
+
+
+    def getIndexFilepath(self, filepath):
+        return os.path.join(self.dirpath, "%s.json" % hashlib.sha1(filepath.encode('utf-8')).hexdigest())
+
+
+    def load(self, filepath, fileKey):
+        try:
+            with open(self.getIndexFilepath(filepath), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get('version') != INDEX_VERSION or data.get('filepath') != filepath:
+            return None
+        if (data.get('size'), data.get('mtime')) != fileKey:
+            return None
+
+        return dict((pluginType, [tuple(p) for p in plugins]) for pluginType, plugins in data['plugins'].items())
+
+
+    def save(self, filepath, fileKey, plugins):
+        indexFilepath = self.getIndexFilepath(filepath)
+        tmpFilepath = "%s.%i.tmp" % (indexFilepath, threading.get_ident())
+
+        data = {
+            'version'  : INDEX_VERSION,
+            'filepath' : filepath,
+            'size'     : fileKey[0],
+            'mtime'    : fileKey[1],
+            'plugins'  : plugins,
+        }
+
+        try:
+            with open(tmpFilepath, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmpFilepath, indexFilepath)
+        except OSError:
+            pass
+
+
+    # Returns { type : [(name, offset), ...] } or None if file is not found
+    # or couldn't be indexed
+    def getPlugins(self, filepath):
+        filepath = os.path.abspath(os.path.expanduser(filepath))
+
+        if not os.path.isfile(filepath):
+            return None
+
+        try:
+            fileKey = getFileKey(filepath)
+        except OSError:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(filepath)
+            if entry is not None and entry[0] == fileKey:
+                self.hits += 1
+                return entry[1]
+
+        plugins = self.load(filepath, fileKey) if self.dirpath else None
+        if plugins is not None:
+            with self.lock:
+                self.hits += 1
+        else:
+            with self.lock:
+                self.misses += 1
+
+            try:
+                if filepath.endswith(".vrscene"):
+                    plugins = indexVrscene(filepath)
+                else:
+                    plugins = indexVrmat(filepath)
+            except (OSError, ValueError, ExpatError):
+                return None
+
+            if self.dirpath:
+                self.save(filepath, fileKey, plugins)
+
+        with self.lock:
+            self.entries[filepath] = (fileKey, plugins)
+
+        return plugins
+
+
+    # Returns material names in file order
+    def getMaterialsNames(self, filepath):
+        plugins = self.getPlugins(filepath)
+        if not plugins:
+            return []
+
+        materials = []
+        for pluginType in plugins:
+            if pluginType.startswith("Mtl") or pluginType == 'material':
+                materials.extend(p for p in plugins[pluginType] if p[0] != 'MANOMATERIALISSET')
+
+        return [name for name, offset in sorted(materials, key=lambda p: p[1])]
+
+
+    # Returns plugin file offset or None if plugin is not found
+    def findPlugin(self, filepath, name, pluginType=None):
+        plugins = self.getPlugins(filepath)
+        if not plugins:
+            return None
+
+        for t in plugins:
+            if pluginType and t != pluginType:
+                continue
+            for pluginName, offset in plugins[t]:
+                if pluginName == name:
+                    return offset
+
+        return None
+
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+        if self.dirpath:
+            for filename in os.listdir(self.dirpath):
+                try:
+                    os.remove(os.path.join(self.dirpath, filename))
+                except OSError:
+                    pass
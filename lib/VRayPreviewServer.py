@@ -0,0 +1,183 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+
+# Keeps one V-Ray standalone process in command mode alive between
+# material previews. Every preview only reloads the exported scene and
+# renders it, so process startup and plugin loading are paid once.
+
+# Python modules
+import atexit
+import os
+import subprocess
+import threading
+import time
+
+from .VRaySocket import VRaySocket
+
+
+# Result file polling interval (seconds)
+POLL_INTERVAL = 0.02
+
+# Preview render time limit (seconds)
+RENDER_TIMEOUT = 30.0
+
+# Scene load reply time limit (seconds)
+LOAD_TIMEOUT = 120.0
+
+
+# JPEG end of image marker
+JPEG_EOI = b'\xff\xd9'
+
+
+# Checks that the result file is not partially written:
+# JPEG files must end with the end of image marker
+def isImageComplete(filepath, size):
+    if os.path.splitext(filepath)[1].lower() not in {'.jpg', '.jpeg'}:
+        return True
+    if size < len(JPEG_EOI):
+        return False
+    try:
+        with open(filepath, 'rb') as f:
+            f.seek(size - len(JPEG_EOI))
+            return f.read(len(JPEG_EOI)) == JPEG_EOI
+    except OSError:
+        return False
+
+
+class VRayPreviewServer():
+    process = None
+    socket  = None
+
+    # Process command line; server is restarted if it changes
+    params = None
+
+    # Set after a failure; previews fall back to separate processes
+    # for the rest of the session
+    failed = None
+
+    def __init__(self):
+        self.socket = VRaySocket()
+        self.socket.longTimeout = LOAD_TIMEOUT
+
+        self.failed = False
+
+        # Previews may be requested from several threads; the process
+        # and its socket are used by one of them at a time
+        self.lock = threading.RLock()
+
+
+    def isRunning(self):
+        if self.process is None:
+            return False
+        return self.process.poll() is None
+
+
+    def start(self, params):
+        self.stop()
+
+        self.params  = params
+        self.process = subprocess.Popen(params + ['-cmdMode=1'])
+
+        if self.socket.connect() is not None:
+            self.stop()
+            return False
+
+        return True
+
+
+    def stop(self):
+        with self.lock:
+            if self.process is None:
+                return
+
+            if self.isRunning():
+                self.socket.send_commands([("stop", True), ("quit", True)])
+                try:
+                    self.process.wait(1.0)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+
+            self.socket.disconnect()
+            self.process = None
+            self.params  = None
+
+
+    # Waits for the result file to be written completely
+    def waitResult(self, loadFile, testBreak=None):
+        start    = time.time()
+        lastSize = None
+
+        while time.time() - start < RENDER_TIMEOUT:
+            if testBreak and testBreak():
+                return False
+            if not self.isRunning():
+                return False
+
+            try:
+                size = os.path.getsize(loadFile)
+            except OSError:
+                size = None
+
+            if size and size == lastSize and isImageComplete(loadFile, size):
+                return True
+            lastSize = size
+
+            time.sleep(POLL_INTERVAL)
+
+        return False
+
+
+    # Renders the scene into 'loadFile'; returns False on failure or break
+    def render(self, params, sceneFile, loadFile, testBreak=None):
+        with self.lock:
+            if self.failed:
+                return False
+
+            if os.path.exists(loadFile):
+                os.remove(loadFile)
+
+            if self.isRunning() and self.params == params:
+                # Scene from the command line is rendered on startup,
+                # otherwise stop any previous (interrupted) render first
+                results = self.socket.send_commands([("stop", True), ("unload", True), ("load %s" % sceneFile, True), ("render", False)])
+                if results is None:
+                    self.failed = True
+            elif not self.start(params):
+                self.failed = True
+
+            if not self.failed:
+                if self.waitResult(loadFile, testBreak):
+                    return True
+                if testBreak and testBreak():
+                    return False
+                self.failed = True
+
+            self.stop()
+            return False
+
+
+PreviewServer = VRayPreviewServer()
+
+atexit.register(PreviewServer.stop)
@@ -36,10 +36,7 @@ import time
 
 # V-Ray/Blender modules
 import vb25
-from vb25.lib import VRaySocket
-
-if sys.platform != 'win32':
-    import fcntl
+from vb25.lib.VRaySocket import VRaySocket
 
 
 def Quotes(path):
@@ -146,18 +143,14 @@ class VRayProcess():
             return
 
         if self.VRayExporter.use_progress:
+            # Output is consumed by VRaySupervisor
             self.process = subprocess.Popen(self.params, bufsize=256, stdout=subprocess.PIPE)
-
-            if vb25.utils.PLATFORM != 'win32':
-                fd = self.process.stdout.fileno()
-                fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-                fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
         else:
             self.process = subprocess.Popen(self.params)
 
         self.exit_ready = False
 
-        time.sleep(0.25)
+        # Retries with backoff while V-Ray is starting
         self.socket.connect()
 
 
@@ -178,56 +171,9 @@ class VRayProcess():
         self.process = None
 
 
-    def get_progress(self):
-        msg  = None
-        prog = None
-
-        if not self.exit_ready:
-            if self.process and self.is_running():
-                stdout_lines = None
-                try:
-                    self.process.stdout.flush()
-                    stdout_lines = self.process.stdout.readlines(256)
-                except:
-                    pass
-
-                if stdout_lines:
-                    for stdout_line in stdout_lines:
-                        line = stdout_line.decode('ascii').strip()
-
-                        if self.VRayExporter.debug:
-                            print(line)
-
-                        if line.find("Building light cache") != -1:
-                            msg = "Light cache"
-                        elif line.find("Prepass") != -1:
-                            prepass_num = line[line.find("Prepass")+7:line.find("of")].strip()
-                            msg = "Irradiance map (prepass %s)" % (prepass_num)
-                        elif line.find("Rendering image") != -1:
-                            msg = "Rendering"
-                        elif line.find("Building caustics") != -1:
-                            msg = "Caustics"
-                        elif line.find("Frame took") != -1:
-                            self.exit_ready = True
-
-                        if msg is None:
-                            continue
-
-                        p_start = line.find("...: ") + 5
-                        p_end   = line.find("%")
-
-                        if p_start != -1 and p_end != -1 and p_end > p_start:
-                            p_str = line[p_start:p_end].strip()
-                            if len(p_str):
-                                prog = float(p_str) / 100.0
-                                break
-
-        return msg, prog
-
-
     def load_scene(self):
         if not self.sceneFile:
-            vb25.utils.vb25.utils.debug(None, "Scene file is not set", error=True)
+            vb25.utils.debug(None, "Scene file is not set", error=True)
             return 'Scene file is not set'
 
         self.socket.send("load %s" % self.sceneFile)
@@ -241,8 +187,11 @@ class VRayProcess():
 
 
     def reload_scene(self):
-        self.unload_scene()
-        self.load_scene()
+        if not self.sceneFile:
+            vb25.utils.debug(None, "Scene file is not set", error=True)
+            return 'Scene file is not set'
+
+        self.socket.send_commands([("unload", True), ("load %s" % self.sceneFile, True)])
         return None
 
 
@@ -252,45 +201,56 @@ class VRayProcess():
 
 
     def quit(self):
-        self.socket.send("stop")
-        self.socket.send("quit")
+        self.socket.send_commands([("stop", True), ("quit", True)])
         self.socket.disconnect()
         return None
 
 
-    def recieve_image(self, progressFile):
-        jpeg_image = None
-        jpeg_size  = 0
-        buff  = []
-
+    # Returns (error, JPEG stream)
+    def get_image(self, quality=90):
         if not self.is_running():
             self.exit_ready = True
-            return 'V-Ray is not running'
+            return 'V-Ray is not running', None
 
         # Request image
-        self.socket.send("getImage 90 1", result=False)
+        self.socket.send("getImage %i 1" % quality, result=False)
 
         # Read image stream size
         jpeg_size_bytes = self.socket.recv(4)
+        if jpeg_size_bytes is None:
+            return 'JPEG stream size recieve fail', None
 
         # Check if 'fail' recieved
         if jpeg_size_bytes == b'fail':
             self.socket.recv(3) # Read 'e', 'd', '\0'
             self.exit_ready = True
-            return 'getImage failed'
+            return 'getImage failed', None
 
         try:
             # Get stream size in bytes
             jpeg_size = struct.unpack("<L", jpeg_size_bytes)[0]
 
-            # print("JPEG stream size = %i"%(jpeg_size))
-
             # Read JPEG stream
             jpeg_image = self.socket.recv(jpeg_size)
+        except:
+            return 'JPEG stream recieve fail', None
 
+        if jpeg_image is None or len(jpeg_image) != jpeg_size:
+            return 'JPEG stream recieve fail', None
+
+        return None, jpeg_image
+
+
+    def recieve_image(self, progressFile, quality=90):
+        err, jpeg_image = self.get_image(quality)
+        if err is not None:
+            return err
+
+        try:
             # Write stream to file
-            open(progressFile, 'wb').write(jpeg_image)
+            with open(progressFile, 'wb') as f:
+                f.write(jpeg_image)
         except:
-            return 'JPEG stream recieve fail'
+            return 'JPEG stream write fail'
 
         return None
@@ -22,6 +22,9 @@
 # All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
 #
 
+import array
+import collections
+import mmap
 import struct
 import os
 import sys
@@ -101,15 +104,24 @@ ChannelFlags = {
 class MeshFileReader(object):
     meshFile = None
 
+    # Memory mapped file contents
+    meshData = None
+
     def report(self, *args):
         if USE_DEBUG:
             print(*args)
 
-    def binRead(self, format, length):
-        rawData = self.meshFile.read(length)
-        data    = struct.unpack(format, rawData)
-        return data
+    def binRead(self, format, offset):
+        return struct.unpack_from("<" + format, self.meshData, offset)
+
 
+# Returns array of the given type from little-endian bytes
+def toArray(data, typecode):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
 
 
 class VoxelChannel(MeshFileReader):
@@ -119,17 +131,15 @@ class VoxelChannel(MeshFileReader):
     depChannelID = None
     flags        = None
 
-    data         = None
+    # Channel data offset in file
+    dataOffset   = None
+    dataSize     = None
 
-    def __init__(self, meshFile):
-        self.meshFile = meshFile
+    data         = None
 
-    def loadInfo(self):
-        self.elementSize  = self.binRead("I", 4)[0]
-        self.numElements  = self.binRead("I", 4)[0]
-        self.channelID    = self.binRead("H", 2)[0]
-        self.depChannelID = self.binRead("H", 2)[0]
-        self.flags        = self.binRead("I", 4)[0]
+    def __init__(self, meshData, info):
+        self.meshData = meshData
+        self.elementSize, self.numElements, self.channelID, self.depChannelID, self.flags = info
 
     def printInfo(self):
         self.report("Channel")
@@ -144,69 +154,63 @@ class VoxelChannel(MeshFileReader):
                 flagsList.append(ChannelFlags[key])
         self.report("  flags        = %s" % (", ".join(flagsList)))
 
-    def loadData(self):        
-        self.report("Channel Data")
-
-        elementsSize = self.elementSize * self.numElements
-
-        dataSize = elementsSize
+    # Finds channel data in file; returns the next channel data offset
+    def loadInfo(self, offset):
+        self.dataSize = self.elementSize * self.numElements
         if self.flags & MF_COMPRESSED:
-            self.report("  Data is compressed")
-            dataSize = self.binRead("I", 4)[0]
+            self.dataSize = self.binRead("I", offset)[0]
+            offset += 4
+        self.dataOffset = offset
 
-        self.report("  Data size = %i" % (dataSize))
+        return offset + self.dataSize
 
-        # Load only channels we need
-        if self.channelID in [VERT_GEOM_CHANNEL, FACE_TOPO_CHANNEL]:
-            channelRawData = self.meshFile.read(dataSize)
+    # Data is read and decompressed on the first access only
+    def getData(self):
+        if self.data is None:
+            self.report("Channel %s data size = %i" % (self.channelID, self.dataSize))
 
-            if self.flags & MF_COMPRESSED:
-                self.data = zlib.decompressobj().decompress(channelRawData)
+            channelRawData = self.meshData[self.dataOffset:self.dataOffset+self.dataSize]
 
-                # self.report("  Compressed data:", channelRawData)
-                # self.report("  Uncompressed data:", self.data)
-                self.report("  Expected / uncompressed size:", elementsSize, len(self.data))
+            if self.flags & MF_COMPRESSED:
+                self.data = zlib.decompress(channelRawData)
             else:
                 self.data = channelRawData
-        else:
-            self.meshFile.seek(dataSize, os.SEEK_CUR)
 
-    def loadChechsum(self):
-        self.report("Channel Checksums")
+        return self.data
 
-        for i in range(self.numElements):
-            channelCRC  = self.binRead("I", 4)[0]
-
-            self.report("  %i: checksum = %i" % (i, channelCRC))
+    def getArray(self, typecode):
+        return toArray(self.getData(), typecode)
 
 
 
 class VoxelChannels(MeshFileReader):
     channels = None
 
-    def __init__(self, meshFile):
-        self.meshFile = meshFile
+    def __init__(self, meshData):
+        self.meshData = meshData
         self.channels = []
-    
-    def loadInfo(self, voxelOffset=None):
-        self.channelCount = self.binRead("I", 4)[0]
+
+    def loadInfo(self, voxelOffset):
+        self.channelCount = self.binRead("I", voxelOffset)[0]
+
+        offset = voxelOffset + 4
+
+        # All channel headers at once
+        info = self.binRead("IIHHI" * self.channelCount, offset)
+        offset += 16 * self.channelCount
 
         for i in range(self.channelCount):
-            voxelChannel = VoxelChannel(self.meshFile)
-            voxelChannel.loadInfo()
+            voxelChannel = VoxelChannel(self.meshData, info[5*i:5*i+5])
+            offset = voxelChannel.loadInfo(offset)
 
             self.channels.append(voxelChannel)
 
     def printInfo(self):
         self.report("Voxel")
         self.report("  Channels count = %i" % (len(self.channels)))
-        
-        for channel in self.channels:
-            channel.printInfo()
 
-    def loadData(self):
         for channel in self.channels:
-            channel.loadData()
+            channel.printInfo()
 
     def getChannelByType(self, channelType=VERT_GEOM_CHANNEL):
         for channel in self.channels:
@@ -216,7 +220,7 @@ class VoxelChannels(MeshFileReader):
 
     def getFaceTopoChannel(self):
         return self.getChannelByType(FACE_TOPO_CHANNEL)
-    
+
     def getVertGeomChannel(self):
         return self.getChannelByType(VERT_GEOM_CHANNEL)
 
@@ -229,9 +233,9 @@ class MeshVoxel(MeshFileReader):
 
     channels = None
 
-    def __init__(self, meshFile):
-        self.meshFile = meshFile
-        self.channels = VoxelChannels(self.meshFile)
+    def __init__(self, meshData):
+        self.meshData = meshData
+        self.channels = VoxelChannels(self.meshData)
 
     def printInfo(self):
         self.report("Voxel")
@@ -239,37 +243,58 @@ class MeshVoxel(MeshFileReader):
         self.report("  bbox       = %s" % ("%.2f,%.2f,%.2f; %.2f,%.2f,%.2f" % (self.bbox)))
         self.report("  flags      = %s" % (VoxelFlags[self.flags]))
 
+    # Reads only channels info; channels data is loaded on request
     def loadData(self):
-        self.meshFile.seek(self.fileOffset)
-
-        self.channels.loadInfo()
+        self.channels.loadInfo(self.fileOffset)
         self.channels.printInfo()
-        self.channels.loadData()
-
-    def chunk(self, input, size):
-        return tuple(zip(*([iter(input)]*size)))
 
+    # Flat array of vertex indices, 3 per face
     def getFaces(self):
         faceTopoChannel = self.channels.getFaceTopoChannel()
-        
+
         if faceTopoChannel is None:
-            return ()
-        
-        intArray   = struct.unpack("%ii"%(len(faceTopoChannel.data) / 4), faceTopoChannel.data)
-        facesArray = self.chunk(intArray, 3)
-        
-        return facesArray
+            return array.array('i')
+
+        return faceTopoChannel.getArray('i')
 
+    # Flat array of vertex coordinates, 3 per vertex
     def getVertices(self):
         vertexChannel = self.channels.getVertGeomChannel()
-        
+
         if vertexChannel is None:
-            return ()
+            return array.array('f')
+
+        return vertexChannel.getArray('f')
+
+
+# Frame index in file for the animation settings
+def getFrameIndex(animLength, animType, animOffset, speed, frame):
+    def clamp(value, value_min, value_max):
+        return max(min(value, value_max), value_min)
+
+    animStart = 0
+
+    if animType in {'0', 'LOOP'}:
+        frame = fmod(animOffset+(frame-animStart)*speed, animLength)
+        if frame < 0:
+            frame += animLength
+        frame += animStart
 
-        floatArray  = struct.unpack("%if"%(len(vertexChannel.data) / 4), vertexChannel.data)
-        vertexArray = self.chunk(floatArray, 3)
-        
-        return vertexArray
+    elif animType in {'1', 'ONCE'}:
+        frame = clamp(animOffset+(frame-animStart)*speed, 0.0, animLength-1)+animStart
+
+    elif animType in {'2', 'PINGPONG'}:
+        frame = fmod(animOffset+(frame-animStart)*speed, animLength*2-2) # subtract 2 to remove the duplicate frames
+        if frame < 0:
+            frame += 2*animLength-2
+        if frame >= animLength:
+            frame = 2*animLength-2-frame
+        frame += animStart*speed
+
+    elif animType in {'3', 'STILL'}:
+        frame = clamp(animOffset+animStart, 0.0, animLength-1.0)
+
+    return int(frame)
 
 
 class VoxelInfo:
@@ -295,22 +320,37 @@ class MeshFile(MeshFileReader):
 
     def __init__(self, filepath):
         self.meshFile = open(os.path.expanduser(filepath), "rb")
+        self.meshData = mmap.mmap(self.meshFile.fileno(), 0, access=mmap.ACCESS_READ)
         self.frames = {}
 
 
+    def close(self):
+        if self.meshFile is None:
+            return
+        self.meshData.close()
+        self.meshFile.close()
+        self.meshData = None
+        self.meshFile = None
+
+
+    def __del__(self):
+        self.close()
+
+
     def readHeader(self):
-        self.vrayID = self.binRead("7s", 7)[0][:-1]
+        self.vrayID = self.binRead("7s", 0)[0][:-1]
 
         if self.vrayID == b'vrmesh':
             # New format
-            self.fileVersion = self.binRead("I", 4)[0]
+            self.fileVersion = self.binRead("I", 7)[0]
+            offset = 11
         else:
             # Old format
-            self.meshFile.seek(0)
-            self.vrayID = self.binRead("4s", 4)[0][:-1]
+            self.vrayID = self.binRead("4s", 0)[0][:-1]
             self.fileVersion = 0
+            offset = 4
 
-        self.lookupOffset = self.binRead("Q", 8)[0]
+        self.lookupOffset = self.binRead("Q", offset)[0]
 
         self.report("MeshFile:", self.meshFile.name)
         self.report("  fileID       = %s" % self.vrayID)
@@ -319,37 +359,39 @@ class MeshFile(MeshFileReader):
 
 
     def readLookUpTable(self):
-        def readVoxelInfo():
-            vi = VoxelInfo()
-
-            vi.fileOffset = self.binRead("Q", 8)[0]
-            vi.bbox       = self.binRead("6f", 24)
-            vi.flags      = self.binRead("I", 4)[0]
+        offset = self.lookupOffset
 
-            return vi
-
-        def readFrameInfo():
-            numVoxels  = self.binRead("I", 4)[0]
+        frameCount = 0
+        while True:
+            numVoxels = self.binRead("I", offset)[0]
+            offset += 4
             if numVoxels == 0:
-                return None
+                break
+
+            # All frame voxels at once
+            voxelsInfo = self.binRead("Q6fI" * numVoxels, offset)
+            offset += 36 * numVoxels
 
             frameInfo = FrameInfo()
             frameInfo.numVoxels = numVoxels
 
             for v in range(numVoxels):
-                frameInfo.voxels.append(readVoxelInfo())
+                vi = VoxelInfo()
+                vi.fileOffset = voxelsInfo[8*v]
+                vi.bbox       = voxelsInfo[8*v+1:8*v+7]
+                vi.flags      = voxelsInfo[8*v+7]
 
-            return frameInfo
+                frameInfo.voxels.append(vi)
 
-        self.meshFile.seek(self.lookupOffset)
+            self.frames[frameCount] = frameInfo
+            frameCount += 1
 
-        frameCount = 0
-        while True:
-            fi = readFrameInfo()
-            if not fi:
+            # Last frame may end at the file end without terminator
+            if offset + 4 > len(self.meshData):
                 break
-            self.frames[frameCount] = fi
-            frameCount += 1
+
+        if not USE_DEBUG:
+            return
 
         for frameNumber in self.frames:
             fi = self.frames[frameNumber]
@@ -370,42 +412,21 @@ class MeshFile(MeshFileReader):
 
 
     def getFrameByType(self, animType, animOffset, speed, frame):
-        def clamp(value, value_min, value_max):
-            return max(min(value, value_max), value_min)
-
-        animLength = len(self.frames)
-        animStart  = 0
-
-        if animType in {'0', 'LOOP'}:
-            frame = fmod(animOffset+(frame-animStart)*speed, animLength)
-            if frame < 0:
-                frame += animLength
-            frame += animStart
-
-        elif animType in {'1', 'ONCE'}:
-            frame = clamp(animOffset+(frame-animStart)*speed, 0.0, animLength-1)+animStart
+        return getFrameIndex(len(self.frames), animType, animOffset, speed, frame)
 
-        elif animType in {'2', 'PINGPONG'}:
-            frame = fmod(animOffset+(frame-animStart)*speed, animLength*2-2) # subtract 2 to remove the duplicate frames
-            if frame < 0:
-                frame += 2*animLength-2
-            if frame >= animLength:
-                frame = 2*animLength-2-frame
-            frame += animStart*speed
 
-        elif animType in {'3', 'STILL'}:
-            frame = clamp(animOffset+animStart, 0.0, animLength-1.0)
-
-        return int(frame)
-
-
-    def getPreviewVoxel(self, frameInfo):
+    def getVoxel(self, frameInfo, flags):
         for voxel in frameInfo.voxels:
-            if voxel.flags == MVF_PREVIEW_VOXEL:
+            if voxel.flags == flags:
                 return voxel
         return None
 
 
+    def getPreviewVoxel(self, frameInfo):
+        return self.getVoxel(frameInfo, MVF_PREVIEW_VOXEL)
+
+
+    # Returns flat vertices and faces arrays of the frame preview voxel
     def getPreviewMesh(self, animType, animOffset, speed, frame=0):
         frameIndex = self.getFrameByType(animType, animOffset, speed, frame)
         if frameIndex not in self.frames:
@@ -415,7 +436,12 @@ class MeshFile(MeshFileReader):
         if not voxelInfo:
             return None
 
-        voxel = MeshVoxel(self.meshFile)
+        return self.getVoxelMesh(voxelInfo)
+
+
+    # Returns flat vertices and faces arrays of the voxel
+    def getVoxelMesh(self, voxelInfo):
+        voxel = MeshVoxel(self.meshData)
         voxel.fileOffset = voxelInfo.fileOffset
         voxel.bbox       = voxelInfo.bbox
         voxel.flags      = voxelInfo.flags
@@ -428,13 +454,588 @@ class MeshFile(MeshFileReader):
         return { 'vertices' : vertices, 'faces' : faces }
 
 
-def main():
-    testFile = "~/devel/vrayblender/test-suite/vrmesh/animated_mesh.vrmesh"
+#
+# PREVIEW CACHE
+#
+# Parsed lookup tables and decoded preview voxels, so scrubbing animated
+# proxies doesn't parse the file again. Entries are keyed by file path,
+# modification time and size, so rewritten files are never served from
+# the cache. Files are not kept open (open mapping would lock the file
+# for proxy regeneration on Windows).
+#
+PREVIEW_CACHE_SIZE = 256 * 1024 * 1024
+
+
+class MeshPreviewCache():
+    maxSize = None
+    size    = None
+
+    # (filepath, mtime, size) -> frames
+    tables   = None
+    # (filepath, mtime, size, frameIndex) -> preview mesh
+    previews = None
 
-    meshFile = MeshFile(testFile)
-    meshFile.readFile()
+    hits   = None
+    misses = None
 
-    mesh = meshFile.getPreviewMesh(0)
+    def __init__(self, maxSize=PREVIEW_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.clear()
+
+    def clear(self):
+        self.tables   = collections.OrderedDict()
+        self.previews = collections.OrderedDict()
+        self.size     = 0
+        self.hits     = 0
+        self.misses   = 0
+
+    def getFileKey(self, filepath):
+        filepath = os.path.abspath(os.path.expanduser(filepath))
+        st = os.stat(filepath)
+        return (filepath, st.st_mtime, st.st_size)
+
+    def put(self, cache, key, item, itemSize):
+        cache[key] = (item, itemSize)
+        self.size += itemSize
+
+        while self.size > self.maxSize and (self.previews or self.tables):
+            oldest = self.previews if self.previews else self.tables
+            oldKey, (oldItem, oldSize) = oldest.popitem(last=False)
+            self.size -= oldSize
+
+    def get(self, cache, key):
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        cache.move_to_end(key)
+        return entry[0]
+
+    # Drops all entries of the file
+    def remove(self, filepath):
+        filepath = os.path.abspath(os.path.expanduser(filepath))
+        for cache in (self.tables, self.previews):
+            for key in [key for key in cache if key[0] == filepath]:
+                self.size -= cache.pop(key)[1]
+
+    def getPreviewMesh(self, filepath, animType, animOffset, speed, frame=0):
+        fileKey = self.getFileKey(filepath)
+
+        meshFile = None
+        try:
+            frames = self.get(self.tables, fileKey)
+            if frames is None:
+                self.remove(fileKey[0])
+                meshFile = MeshFile(fileKey[0])
+                meshFile.readFile()
+                frames = meshFile.frames
+                self.put(self.tables, fileKey, frames, sum([36 * fi.numVoxels for fi in frames.values()]))
+
+            frameIndex = getFrameIndex(len(frames), animType, animOffset, speed, frame)
+
+            previewKey = fileKey + (frameIndex,)
+            meshData = self.get(self.previews, previewKey)
+            if meshData is not None:
+                self.hits += 1
+                return meshData
+            self.misses += 1
+
+            if meshFile is None:
+                meshFile = MeshFile(fileKey[0])
+                meshFile.frames = frames
+
+            meshData = meshFile.getPreviewMesh(animType, animOffset, speed, frame)
+            if meshData is not None:
+                self.put(self.previews, previewKey, meshData, sum([len(v) * v.itemsize for v in meshData.values()]))
+
+            return meshData
+
+        finally:
+            if meshFile is not None:
+                meshFile.close()
+
+
+PreviewCache = MeshPreviewCache()
+
+
+#
+# WRITER
+#
+# File layout mirrors the reader above and follows files written by
+# the bundled proxy creator (see compareWithProxyCreator()):
+#   header:  "vrmesh\0", version, lookup table offset
+#   voxels:  channels count, channel headers, channels data
+#   lookup:  for every frame - voxels count and voxels info;
+#            zero voxels count ends the table
+#
+# Geometry is split into voxels of at most GEOMETRY_VOXEL_FACES faces;
+# every frame also has a preview voxel with at most PREVIEW_FACES faces.
+#
+VRMESH_VERSION = 0x1000
+
+# Max faces in a geometry voxel
+GEOMETRY_VOXEL_FACES = 10000
+
+# Max faces in the preview voxel
+PREVIEW_FACES = 1000
+
+
+# Returns little-endian bytes of a numeric sequence
+def toBytes(values, typecode):
+    if type(values) is not array.array or values.typecode != typecode:
+        values = array.array(typecode, values)
+    if sys.byteorder != 'little':
+        values = array.array(typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def getBBox(vertices):
+    if not len(vertices):
+        return (0.0,) * 6
+    xs = vertices[0::3]
+    ys = vertices[1::3]
+    zs = vertices[2::3]
+    return (min(xs), min(ys), min(zs), max(xs), max(ys), max(zs))
+
+
+# Returns channel header and channel data
+def encodeChannel(channelID, depChannelID, flags, elementSize, data, compressLevel=6):
+    numElements = len(data) // elementSize
+
+    if compressLevel:
+        flags |= MF_COMPRESSED
+        data   = zlib.compress(data, compressLevel)
+        data   = struct.pack("<I", len(data)) + data
+
+    header = struct.pack("<IIHHI", elementSize, numElements, channelID, depChannelID, flags)
+
+    return header, data
+
+
+def encodeVoxel(channels):
+    voxelData = [struct.pack("<I", len(channels))]
+    voxelData.extend([header for header,data in channels])
+    voxelData.extend([data   for header,data in channels])
+    return b''.join(voxelData)
+
+
+# Splits faces in two along the longest bounding box axis until every
+# part has at most 'maxFaces' faces. Face goes to the lower part if any
+# of its vertices is below the middle of the axis (as proxy creator does).
+def splitFaces(vertices, faces, maxFaces):
+    parts = []
+    stack = [list(range(len(faces) // 3))]
+
+    while stack:
+        part = stack.pop()
+        if len(part) <= maxFaces:
+            parts.append(part)
+            continue
+
+        partVertices = array.array('f')
+        for f in part:
+            for v in faces[3*f:3*f+3]:
+                partVertices.extend(vertices[3*v:3*v+3])
+        bbox = getBBox(partVertices)
+
+        axis   = max(range(3), key=lambda i: bbox[i+3] - bbox[i])
+        middle = (bbox[axis] + bbox[axis+3]) / 2.0
+
+        lower = []
+        upper = []
+        for f in part:
+            if min(vertices[3*v+axis] for v in faces[3*f:3*f+3]) < middle:
+                lower.append(f)
+            else:
+                upper.append(f)
+
+        # Degenerate part: split by count
+        if not lower or not upper:
+            lower = part[:len(part) // 2]
+            upper = part[len(part) // 2:]
+
+        stack.append(upper)
+        stack.append(lower)
+
+    return parts
+
+
+# Picks 3-component elements used by the faces; returns picked elements,
+# topology reindexed to them and source indices of the picked elements
+def pickElements(values, topology, faceIndices):
+    indexMap = {}
+    order    = []
+
+    picked        = array.array('f')
+    pickedIndices = array.array('i')
+
+    for f in faceIndices:
+        for i in topology[3*f:3*f+3]:
+            j = indexMap.get(i)
+            if j is None:
+                j = indexMap[i] = len(order)
+                order.append(i)
+                picked.extend(values[3*i:3*i+3])
+            pickedIndices.append(j)
+
+    return picked, pickedIndices, order
+
+
+# Geometry voxels from triangulated mesh data.
+# All sequences are flat: 3 floats per vector, 3 indices per face;
+# 'mtlIDs' has one item per face.
+# Velocity channel is not written by proxy creator, so it is the only
+# channel not checked against its output.
+def encodeGeometryVoxels(vertices, faces, normals=None, normalFaces=None, uvs=None, uvFaces=None, velocities=None, mtlIDs=None, maxFaces=GEOMETRY_VOXEL_FACES, compressLevel=6):
+    voxels = []
+
+    for faceIndices in splitFaces(vertices, faces, maxFaces):
+        voxelVertices, voxelFaces, order = pickElements(vertices, faces, faceIndices)
+
+        channels = []
+
+        channels.append(encodeChannel(VERT_GEOM_CHANNEL, FACE_TOPO_CHANNEL, MF_VERT_CHANNEL, 12, toBytes(voxelVertices, 'f'), compressLevel))
+        channels.append(encodeChannel(FACE_TOPO_CHANNEL, 0, MF_TOPO_CHANNEL, 12, toBytes(voxelFaces, 'i'), compressLevel))
+
+        if velocities is not None:
+            voxelVelocities = array.array('f')
+            for i in order:
+                voxelVelocities.extend(velocities[3*i:3*i+3])
+            channels.append(encodeChannel(VERT_VELOCITY_CHANNEL, FACE_TOPO_CHANNEL, MF_VERT_CHANNEL, 12, toBytes(voxelVelocities, 'f'), compressLevel))
+
+        if normals is not None:
+            voxelNormals, voxelNormalFaces, order = pickElements(normals, normalFaces, faceIndices)
+            channels.append(encodeChannel(VERT_NORMAL_CHANNEL, VERT_NORMAL_TOPO_CHANNEL, MF_VERT_CHANNEL, 12, toBytes(voxelNormals, 'f'), compressLevel))
+            channels.append(encodeChannel(VERT_NORMAL_TOPO_CHANNEL, 0, MF_TOPO_CHANNEL, 12, toBytes(voxelNormalFaces, 'i'), compressLevel))
+
+        if mtlIDs is not None:
+            # Face info: two unused ints and material ID
+            faceInfo = array.array('i', [0]) * (3 * len(faceIndices))
+            faceInfo[2::3] = array.array('i', [mtlIDs[f] for f in faceIndices])
+            channels.append(encodeChannel(FACE_INFO_CHANNEL, 0, MF_FACE_CHANNEL, 12, toBytes(faceInfo, 'i'), compressLevel))
+
+        if uvs is not None:
+            voxelUVs, voxelUVFaces, order = pickElements(uvs, uvFaces, faceIndices)
+            channels.append(encodeChannel(VERT_TEX_CHANNEL0+1, VERT_TEX_TOPO_CHANNEL0+1, MF_VERT_CHANNEL, 12, toBytes(voxelUVs, 'f'), compressLevel))
+            channels.append(encodeChannel(VERT_TEX_TOPO_CHANNEL0+1, 0, MF_TOPO_CHANNEL, 12, toBytes(voxelUVFaces, 'i'), compressLevel))
+
+        voxels.append((encodeVoxel(channels), getBBox(voxelVertices), MVF_GEOMETRY_VOXEL))
+
+    return voxels
+
+
+# Preview voxel: evenly picked faces with own vertices per face corner.
+# Bounding box is the whole mesh bounding box.
+def encodePreviewVoxel(vertices, faces, maxFaces=PREVIEW_FACES, compressLevel=6):
+    numFaces = len(faces) // 3
+
+    if numFaces > maxFaces:
+        faceIndices = [(k + 1) * numFaces // maxFaces - 1 for k in range(maxFaces)]
+    else:
+        faceIndices = range(numFaces)
+
+    previewVertices = array.array('f')
+    for f in faceIndices:
+        for v in faces[3*f:3*f+3]:
+            previewVertices.extend(vertices[3*v:3*v+3])
+    previewFaces = array.array('i', range(len(previewVertices) // 3))
+
+    channels = [
+        encodeChannel(VERT_GEOM_CHANNEL, FACE_TOPO_CHANNEL, MF_VERT_CHANNEL, 12, toBytes(previewVertices, 'f'), compressLevel),
+        encodeChannel(FACE_TOPO_CHANNEL, 0, MF_TOPO_CHANNEL, 12, toBytes(previewFaces, 'i'), compressLevel),
+    ]
+
+    return encodeVoxel(channels), getBBox(vertices), MVF_PREVIEW_VOXEL
+
+
+class MeshFileWriter():
+    filepath = None
+    meshFile = None
+
+    # For every frame: list of (fileOffset, bbox, flags)
+    frames = None
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.meshFile = open(os.path.expanduser(filepath), "wb")
+        self.frames = []
+
+        self.meshFile.write(b'vrmesh\0')
+        self.meshFile.write(struct.pack("<I", VRMESH_VERSION))
+        self.meshFile.write(struct.pack("<Q", 0)) # Lookup table offset is written on close
+
+
+    # 'voxels' is a list of (voxelData, bbox, flags) as returned by
+    # encodeGeometryVoxels() / encodePreviewVoxel()
+    def writeFrame(self, voxels):
+        frameInfo = []
+        for voxelData, bbox, flags in voxels:
+            frameInfo.append((self.meshFile.tell(), bbox, flags))
+            self.meshFile.write(voxelData)
+        self.frames.append(frameInfo)
+
+
+    def close(self):
+        lookupOffset = self.meshFile.tell()
+
+        for frameInfo in self.frames:
+            self.meshFile.write(struct.pack("<I", len(frameInfo)))
+            for fileOffset, bbox, flags in frameInfo:
+                self.meshFile.write(struct.pack("<Q6fI", fileOffset, *(tuple(bbox) + (flags,))))
+        self.meshFile.write(struct.pack("<I", 0))
+
+        self.meshFile.seek(7 + 4)
+        self.meshFile.write(struct.pack("<Q", lookupOffset))
+
+        self.meshFile.close()
+        self.meshFile = None
+
+        PreviewCache.remove(self.filepath)
+
+
+    # Removes partially written file
+    def abort(self):
+        if self.meshFile is None:
+            return
+
+        self.meshFile.close()
+        self.meshFile = None
+
+        try:
+            os.remove(os.path.expanduser(self.filepath))
+        except OSError:
+            pass
+
+        PreviewCache.remove(self.filepath)
+
+
+#
+# WRITER CHECKS
+#
+
+# Flat grid mesh used by the checks: 'size' x 'size' quads split into
+# triangles, per corner normals and UVs, 3 materials. All values are
+# exact in "%.6f" text, so proxy creator reads them without rounding.
+def getCheckMesh(size, offset=0.0):
+    vertices = array.array('f')
+    for y in range(size + 1):
+        for x in range(size + 1):
+            vertices.extend([x * 0.5 + offset, y * 0.25, 0.125 * ((x + y) % 3)])
+
+    faces = array.array('i')
+    for y in range(size):
+        for x in range(size):
+            a = y * (size + 1) + x
+            faces.extend([a, a+1, a+size+2, a+size+2, a+size+1, a])
+
+    numFaces = len(faces) // 3
+
+    normals = array.array('f')
+    uvs     = array.array('f')
+    for f in range(numFaces):
+        for c in range(3):
+            normals.extend([0.0, 0.125 * (f % 5), 1.0])
+            uvs.extend([0.25 * c, 0.125 * (f % 7), 0.0])
+
+    corners = array.array('i', range(3 * numFaces))
+    mtlIDs  = array.array('i', [f % 3 + 1 for f in range(numFaces)])
+
+    return {
+        'vertices'    : vertices,
+        'faces'       : faces,
+        'normals'     : normals,
+        'normalFaces' : corners,
+        'uvs'         : uvs,
+        'uvFaces'     : corners,
+        'mtlIDs'      : mtlIDs,
+    }
+
+
+def writeCheckMesh(filepath, frames):
+    writer = MeshFileWriter(filepath)
+    for mesh in frames:
+        voxels = encodeGeometryVoxels(mesh['vertices'], mesh['faces'],
+                                      normals=mesh['normals'], normalFaces=mesh['normalFaces'],
+                                      uvs=mesh['uvs'], uvFaces=mesh['uvFaces'],
+                                      mtlIDs=mesh['mtlIDs'])
+        voxels.append(encodePreviewVoxel(mesh['vertices'], mesh['faces']))
+        writer.writeFrame(voxels)
+    writer.close()
+
+
+# Writes mesh as proxy creator ".hq" text (same as proxy.write_mesh_hq())
+def writeCheckMeshHQ(filepath, mesh):
+    vertices = mesh['vertices']
+    normals  = mesh['normals']
+    uvs      = mesh['uvs']
+
+    with open(filepath, 'w') as f:
+        for v in range(len(vertices) // 3):
+            f.write("v=%.6f,%.6f,%.6f\n" % tuple(vertices[3*v:3*v+3]))
+            f.write("l=0.0,0.0,0.0\n")
+        for t in range(len(mesh['faces']) // 3):
+            f.write("f=%d,%d,%d;%d\n" % (tuple(mesh['faces'][3*t:3*t+3]) + (mesh['mtlIDs'][t],)))
+            f.write("fn=%i,%i,%i\n" % tuple(mesh['normalFaces'][3*t:3*t+3]))
+        for n in range(len(normals) // 3):
+            f.write("n=%.6f,%.6f,%.6f\n" % tuple(normals[3*n:3*n+3]))
+        for u in range(len(uvs) // 3):
+            f.write("uv=%.6f,%.6f,%.6f\n" % tuple(uvs[3*u:3*u+3]))
+        for t in range(len(mesh['uvFaces']) // 3):
+            f.write("uf=%i,%i,%i\n" % tuple(mesh['uvFaces'][3*t:3*t+3]))
+        f.write("\n")
+
+
+# Describes every frame of the file: voxel flags and bounding boxes,
+# channels layout and sorted triangles (corner positions, normals,
+# UVs and material ID) of the geometry voxels, preview faces count
+def describeMeshFile(filepath):
+    meshFile = MeshFile(filepath)
+    try:
+        meshFile.readFile()
+
+        description = {
+            'version' : meshFile.fileVersion,
+            'frames'  : [],
+        }
+
+        for frameIndex in sorted(meshFile.frames):
+            voxels    = []
+            triangles = []
+
+            for voxelInfo in meshFile.frames[frameIndex].voxels:
+                voxel = MeshVoxel(meshFile.meshData)
+                voxel.fileOffset = voxelInfo.fileOffset
+                voxel.loadData()
+
+                channels = voxel.channels
+                layout   = sorted((c.channelID, c.depChannelID, c.flags, c.elementSize) for c in channels.channels)
+
+                voxels.append((voxelInfo.flags, tuple(voxelInfo.bbox), len(voxel.getFaces()) // 3, layout))
+
+                if voxelInfo.flags != MVF_GEOMETRY_VOXEL:
+                    continue
+
+                vertices    = voxel.getVertices()
+                faces       = voxel.getFaces()
+                normals     = channels.getChannelByType(VERT_NORMAL_CHANNEL).getArray('f')
+                normalFaces = channels.getChannelByType(VERT_NORMAL_TOPO_CHANNEL).getArray('i')
+                uvs         = channels.getChannelByType(VERT_TEX_CHANNEL0+1).getArray('f')
+                uvFaces     = channels.getChannelByType(VERT_TEX_TOPO_CHANNEL0+1).getArray('i')
+                faceInfo    = channels.getChannelByType(FACE_INFO_CHANNEL).getArray('i')
+
+                for f in range(len(faces) // 3):
+                    triangles.append((
+                        tuple(tuple(vertices[3*v:3*v+3]) for v in faces[3*f:3*f+3]),
+                        tuple(tuple(normals[3*n:3*n+3])  for n in normalFaces[3*f:3*f+3]),
+                        tuple(tuple(uvs[3*u:3*u+3])      for u in uvFaces[3*f:3*f+3]),
+                        faceInfo[3*f+2],
+                    ))
+
+            description['frames'].append({
+                'voxels'    : voxels,
+                'triangles' : sorted(triangles),
+            })
+
+        return description
+
+    finally:
+        meshFile.close()
+
+
+# Writes a small animated mesh with MeshFileWriter and reads it back
+# with MeshFile; returns True if the mesh of every frame matches
+def checkMeshFileWriter(filepath):
+    frames = [getCheckMesh(4, offset=frame) for frame in range(3)]
+
+    writeCheckMesh(filepath, frames)
+
+    description = describeMeshFile(filepath)
+    if description['version'] != VRMESH_VERSION or len(description['frames']) != len(frames):
+        return False
+
+    for mesh, frame in zip(frames, description['frames']):
+        vertices = mesh['vertices']
+        faces    = mesh['faces']
+        normals  = mesh['normals']
+        uvs      = mesh['uvs']
+
+        triangles = sorted((
+            tuple(tuple(vertices[3*v:3*v+3]) for v in faces[3*f:3*f+3]),
+            tuple(tuple(normals[3*c:3*c+3])  for c in range(3*f, 3*f+3)),
+            tuple(tuple(uvs[3*c:3*c+3])      for c in range(3*f, 3*f+3)),
+            mesh['mtlIDs'][f],
+        ) for f in range(len(faces) // 3))
+
+        if frame['triangles'] != triangles:
+            return False
+
+    return True
+
+
+# Writes the same meshes with proxy creator and MeshFileWriter and
+# compares the files; returns a list of differences. Meshes are large
+# enough to be split into several geometry voxels.
+def compareWithProxyCreator(proxyCreator, dirpath):
+    import subprocess
+
+    frames = [getCheckMesh(size, offset=size) for size in (4, 72, 150)]
+
+    proxyCreatorFilepath = os.path.join(dirpath, "proxycreator.vrmesh")
+    writerFilepath       = os.path.join(dirpath, "writer.vrmesh")
+    hqFilepath           = os.path.join(dirpath, "mesh.hq")
+
+    for i,mesh in enumerate(frames):
+        writeCheckMeshHQ(hqFilepath, mesh)
+        cmd = [proxyCreator]
+        if i:
+            cmd.append('--append')
+        cmd.extend([hqFilepath, proxyCreatorFilepath])
+        subprocess.check_call(cmd, stdout=subprocess.DEVNULL)
+    os.remove(hqFilepath)
+
+    writeCheckMesh(writerFilepath, frames)
+
+    expected = describeMeshFile(proxyCreatorFilepath)
+    result   = describeMeshFile(writerFilepath)
+
+    differences = []
+    if expected['version'] != result['version']:
+        differences.append("version: 0x%X != 0x%X" % (result['version'], expected['version']))
+    if len(expected['frames']) != len(result['frames']):
+        differences.append("frames: %i != %i" % (len(result['frames']), len(expected['frames'])))
+
+    for frameIndex,(frame, expectedFrame) in enumerate(zip(result['frames'], expected['frames'])):
+        for key in ('voxels', 'triangles'):
+            if frame[key] != expectedFrame[key]:
+                differences.append("frame %i: %s differ" % (frameIndex, key))
+
+    os.remove(proxyCreatorFilepath)
+    os.remove(writerFilepath)
+
+    return differences
+
+
+def main():
+    import tempfile
+
+    checkFile = os.path.join(tempfile.gettempdir(), "vrmesh_writer_check.vrmesh")
+    print("MeshFileWriter round trip: %s" % ("OK" if checkMeshFileWriter(checkFile) else "FAILED"))
+    os.remove(checkFile)
+
+    # Bundled proxy creator for this platform
+    binDirpath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin")
+    if sys.platform == 'linux':
+        proxyCreator = os.path.join(binDirpath, "proxycreator_linux_%s" % ('64' if sys.maxsize > 2**32 else '32'))
+    elif sys.platform == 'darwin':
+        proxyCreator = os.path.join(binDirpath, "proxycreator_mac")
+    else:
+        proxyCreator = os.path.join(binDirpath, "proxycreator_windows_%s.exe" % ('64' if sys.maxsize > 2**32 else '32'))
+
+    if os.path.exists(proxyCreator):
+        differences = compareWithProxyCreator(proxyCreator, tempfile.gettempdir())
+        print("MeshFileWriter vs proxy creator: %s" % ("OK" if not differences else "FAILED"))
+        for difference in differences:
+            print("  %s" % difference)
 
 
 if __name__ == '__main__':
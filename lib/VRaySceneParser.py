@@ -22,106 +22,174 @@
 # All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
 #
 
-from .pyparsing import Literal, CaselessLiteral, Word, Keyword
-from .pyparsing import OneOrMore, ZeroOrMore, Group, Combine, Optional
-from .pyparsing import alphas, nums, alphanums, quotedString, delimitedList, quotedString
-from .pyparsing import restOfLine, cStyleComment
 
-
-# Returns parsed description dict
+# Streaming .vrscene parser.
 #
-def getPluginDesc(s,loc,toks):
-    plType  = toks[0][0]
-    plName  = toks[0][1]
-    plAttrs = toks[0][2]
+# The file is memory mapped and scanned with regular expressions;
+# quoted strings (hex lists data mostly) are skipped with find(), so
+# large payloads are never copied unless requested.
 
-    attrs = {}
-    for plAttr in plAttrs:
-        attrs[plAttr[0]] = plAttr[1]
+import collections
+import mmap
+import os
+import re
+
+
+# Whitespace and comments
+SPACE_RE     = re.compile(br'(?:\s+|//[^\n]*|/\*.*?\*/)*', re.S)
+DIRECTIVE_RE = re.compile(br'#[^\n]*')
+HEADER_RE    = re.compile(br'([A-Za-z_]\w*)[ \t]+([\w@:|.]+)\s*\{')
+PARAM_RE     = re.compile(br'([\w@:.]+)\s*=\s*')
+VALUE_RE     = re.compile(br'[^";{}/]+')
+
+INT_RE    = re.compile(r'[+-]?\d+$')
+FLOAT_RE  = re.compile(r'[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?$')
+COLOR_RE  = re.compile(r'A?Color\s*\(([^)]*)\)$')
+
+# Longer values are not decoded, ValueRef is returned instead
+MAX_VALUE_SIZE = 4096
+
+
+PluginInfo = collections.namedtuple('PluginInfo', ('type', 'name', 'offset', 'params'))
+
+# Position of the value data in file
+ValueRef = collections.namedtuple('ValueRef', ('offset', 'size'))
+
+
+# Returns position of the value end (';' or '}')
+def skipValue(data, pos):
+    size = len(data)
+    while pos < size:
+        m = VALUE_RE.match(data, pos)
+        if m:
+            pos = m.end()
+            if pos >= size:
+                break
+
+        c = data[pos:pos+1]
+        if c == b'"':
+            quote = data.find(b'"', pos+1)
+            pos = size if quote == -1 else quote+1
+        elif c == b'/':
+            end = SPACE_RE.match(data, pos).end()
+            pos = end if end > pos else pos+1
+        else:
+            break
+    return pos
 
-    return {
-        "ID" : plType,
-        "Name" : plName,
-        "Attributes" : attrs,
-    }
 
-# Converters
-#
-to_int    = lambda s,l,t: int(t[0])
-to_float  = lambda s,l,t: float(t[0])
-to_vector = lambda s,l,t: tuple(t[0])
-no_quotes = lambda s,l,t: t[0][1:-1]
+def parseValue(data, start, end):
+    if end - start > MAX_VALUE_SIZE:
+        return ValueRef(start, end - start)
 
-# Generic syntax
-#
-lparen = Literal("(").suppress()
-rparen = Literal(")").suppress()
-lbrace = Literal("{").suppress()
-rbrace = Literal("}").suppress()
-equals = Literal("=").suppress()
-semi   = Literal(";").suppress()
-dot    = Literal(".")
-comma  = Literal(",")
-
-# Keywords
-#
-Color = Keyword("Color").suppress()
-AColor = Keyword("AColor").suppress()
+    value = data[start:end].decode('utf-8', 'replace').strip()
 
-# Values
-#
-nameType = Word(alphanums+"@_")
+    if INT_RE.match(value):
+        return int(value)
+    if FLOAT_RE.match(value):
+        return float(value)
 
-real    = Combine(Word(nums+"+-", nums) + dot + Optional(Word(nums)) + Optional(CaselessLiteral("E") + Word(nums+"+-",nums))).setParseAction(to_float)
-integer = Word(nums+"+-", nums).setParseAction(to_int)
+    m = COLOR_RE.match(value)
+    if m:
+        try:
+            return tuple([float(c) for c in m.group(1).split(',')])
+        except ValueError:
+            return value
 
-color  = Color + lparen + Group(delimitedList(real)).setParseAction(to_vector) + rparen
-acolor = AColor + lparen + Group(delimitedList(real)).setParseAction(to_vector) + rparen
+    if len(value) > 1 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1]
 
-output = nameType + Optional(Word("::") + Word(alphas+"_"))
+    return value
 
-# Plugin Attribute
-#
-attrName  = nameType
-attrValue = integer ^ real ^ color ^ acolor ^ nameType ^ output ^ quotedString.setParseAction(no_quotes)
 
-pluginAttr = Group(attrName + equals + attrValue + semi)
+# Yields PluginInfo for every plugin in the file.
+# Parameters are parsed only if 'withParams' is set.
+def IterPlugins(filepath, withParams=False):
+    with open(filepath, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
 
-# Plugin
-#
-pluginType = Word(alphanums)
-pluginName = Word(alphanums+"@_")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = len(data)
+            pos  = 0
+            while True:
+                pos = SPACE_RE.match(data, pos).end()
+                if pos >= size:
+                    break
 
-pluginDesc = Group(pluginType + pluginName + lbrace + Group(ZeroOrMore(pluginAttr)) + rbrace).setParseAction(getPluginDesc)
-pluginDesc.ignore("//"+restOfLine)
-pluginDesc.ignore(cStyleComment)
+                if data[pos:pos+1] == b'#':
+                    pos = DIRECTIVE_RE.match(data, pos).end()
+                    continue
+
+                m = HEADER_RE.match(data, pos)
+                if not m:
+                    # Unknown statement; skip the line
+                    lineEnd = data.find(b'\n', pos)
+                    pos = size if lineEnd == -1 else lineEnd+1
+                    continue
+
+                pluginType = m.group(1).decode('ascii')
+                pluginName = m.group(2).decode('utf-8', 'replace')
+                offset     = m.start()
+                params     = collections.OrderedDict() if withParams else None
+
+                pos = m.end()
+                while True:
+                    pos = SPACE_RE.match(data, pos).end()
+                    if pos >= size:
+                        break
+
+                    if data[pos:pos+1] == b'}':
+                        pos += 1
+                        break
+
+                    m = PARAM_RE.match(data, pos)
+                    if m:
+                        pos = m.end()
+
+                    end = skipValue(data, pos)
+                    if m and withParams:
+                        params[m.group(1).decode('ascii')] = parseValue(data, pos, end)
+                    # Always move forward
+                    pos = max(end, pos+1) if not m else end
+
+                    if data[pos:pos+1] == b';':
+                        pos += 1
+
+                yield PluginInfo(pluginType, pluginName, offset, params)
+        finally:
+            data.close()
+
+
+# Returns value data referenced with ValueRef
+def ReadValue(filepath, valueRef):
+    with open(filepath, 'rb') as f:
+        f.seek(valueRef.offset)
+        return f.read(valueRef.size).decode('utf-8', 'replace').strip()
 
-# Scene
-#
-sceneDesc = OneOrMore(pluginDesc)
-sceneDesc.ignore("//"+restOfLine)
-sceneDesc.ignore(cStyleComment)
 
-nameParser = ZeroOrMore(Group(pluginType + pluginName + lbrace))
-nameParser.ignore("//"+restOfLine)
-nameParser.ignore(cStyleComment)
+# Returns parsed description dict
+#
+def getPluginDesc(pluginInfo):
+    return {
+        "ID" : pluginInfo.type,
+        "Name" : pluginInfo.name,
+        "Attributes" : dict(pluginInfo.params),
+    }
 
 
 def ParseVrscene(filepath):
-    return sceneDesc.parseString(open(filepath, "r").read())
+    return [getPluginDesc(pluginInfo) for pluginInfo in IterPlugins(filepath, withParams=True)]
 
 
 def GetMaterialsNames(filepath):
     materialPluginNames = []
-    with open(filepath, "r") as f:
-        for l in f:
-            result = nameParser.parseString(l)
-            if result:
-                res = result[0]
-                if res[0].startswith("Mtl"):
-                    if res[1] == 'MANOMATERIALISSET':
-                        continue
-                    materialPluginNames.append(res[1])
+    for pluginInfo in IterPlugins(filepath):
+        if pluginInfo.type.startswith("Mtl"):
+            if pluginInfo.name == 'MANOMATERIALISSET':
+                continue
+            materialPluginNames.append(pluginInfo.name)
     return materialPluginNames
 
 
@@ -23,9 +23,13 @@
 #
 
 # VRay Standalone communication socket
+#
+# Commands are '\0' terminated strings; most commands reply with a
+# '\0' terminated result. Replies are read through a receive buffer.
 
 # Python modules
 import socket
+import time
 
 
 class VRaySocket():
@@ -33,30 +37,57 @@ class VRaySocket():
     address = "localhost"
     port    = 4368
 
+    # Socket operations timeout (seconds)
+    timeout = 5.0
+
+    # Replies to these commands come only after the scene is loaded or
+    # rendered; None waits for them without a timeout
+    longCommands = ('load', 'render')
+    longTimeout  = None
+
+    # Connection attempts and delay before the first retry (seconds)
+    connectRetries = 6
+    connectDelay   = 0.1
 
-    def __init__(self, address):
-        self.address = address
+    # Receive buffer
+    buffer = None
 
 
-    def __init__(self):
-        pass
+    def __init__(self, address=None, port=None):
+        if address is not None:
+            self.address = address
+        if port is not None:
+            self.port = port
+
+        self.buffer = bytearray()
 
 
     def __del__(self):
         self.disconnect()
 
 
-    def connect(self):
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.address, self.port))
-        except socket.error:
-            self.socket = None
+    # Connects with exponential backoff; V-Ray may still be starting.
+    # Used right after V-Ray is started, other callers use retries=0
+    def connect(self, retries=None):
+        if retries is None:
+            retries = self.connectRetries
 
-        if self.socket is None:
-            return False
+        self.disconnect()
 
-        return None
+        delay = self.connectDelay
+        for i in range(retries + 1):
+            try:
+                self.socket = socket.create_connection((self.address, self.port), self.timeout)
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return None
+            except socket.error:
+                self.socket = None
+
+            if i < retries:
+                time.sleep(delay)
+                delay *= 2.0
+
+        return False
 
 
     def isconnected(self):
@@ -66,53 +97,107 @@ class VRaySocket():
 
 
     def disconnect(self):
+        self.buffer = bytearray()
+
         if self.socket is None:
             return
-        self.socket.close()
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
         self.socket = None
 
 
-    def get_result(self):
-        res = b''
+    # Single connection attempt; doesn't wait for V-Ray to start
+    def ensureConnected(self):
+        if self.socket is None:
+            if self.connect(retries=0) is not None:
+                return False
+        return True
+
+
+    # Fills the buffer with at least 'size' bytes
+    def fill(self, size):
+        while len(self.buffer) < size:
+            data = self.socket.recv(max(size - len(self.buffer), 65536))
+            if not data:
+                raise socket.error("Connection closed")
+            self.buffer.extend(data)
 
+
+    def readExact(self, size):
+        self.fill(size)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+    def readUntil(self, delimiter=b'\0'):
+        start = 0
         while True:
-            r = self.socket.recv(1);
-            if r == b'\0':
+            pos = self.buffer.find(delimiter, start)
+            if pos != -1:
                 break
-            if r != b'\n':
-                res += r;
+            start = len(self.buffer)
+            self.fill(start + 1)
 
-        return res
+        data = bytes(self.buffer[:pos])
+        del self.buffer[:pos+len(delimiter)]
+        return data
 
 
-    def send(self, cmd, result=True):
-        if self.socket is None:
-            res = self.connect()
-            if res is not None:
-                return
+    def get_result(self):
+        return self.readUntil(b'\0').replace(b'\n', b'')
 
-        sent_size = None
-        sent_res  = None
 
-        try:
-            sent_size = self.socket.send(bytes(cmd+'\0', 'ascii'))
-            if result:
-                sent_res = self.get_result()
-        except:
+    def getTimeout(self, cmd):
+        if cmd.split(' ', 1)[0] in self.longCommands:
+            return self.longTimeout
+        return self.timeout
+
+
+    # Sends commands at once and then reads the results.
+    # 'commands' is a list of (cmd, result) tuples.
+    # Returns a list of results or None on error.
+    def send_commands(self, commands):
+        if not self.ensureConnected():
             return None
 
+        try:
+            self.socket.sendall(b''.join(bytes(cmd+'\0', 'ascii') for cmd, result in commands))
+
+            results = []
+            for cmd, result in commands:
+                if not result:
+                    results.append(None)
+                    continue
+                self.socket.settimeout(self.getTimeout(cmd))
+                try:
+                    results.append(self.get_result())
+                finally:
+                    self.socket.settimeout(self.timeout)
+            return results
+        except (socket.error, socket.timeout):
+            self.disconnect()
+
         return None
 
 
+    def send(self, cmd, result=True):
+        results = self.send_commands([(cmd, result)])
+        if results is None:
+            return None
+        return results[0]
+
+
+    # Returns exactly 'size' bytes or None on error
     def recv(self, size):
-        if self.socket is None:
-            res = self.connect()
-            if res is not None:
-                return None
+        if not self.ensureConnected():
+            return None
 
-        b = None
         try:
-            b = self.socket.recv(size)
-        except:
-            pass
-        return b
+            return self.readExact(size)
+        except (socket.error, socket.timeout):
+            self.disconnect()
+
+        return None
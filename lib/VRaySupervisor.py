@@ -0,0 +1,244 @@
+#
+# V-Ray/Blender
+#
+# http://vray.cgdo.ru
+#
+# Author: Andrey M. Izrantsev (aka bdancer)
+# E-Mail: izrantsev@cgdo.ru
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# All Rights Reserved. V-Ray(R) is a registered trademark of Chaos Software.
+#
+
+
+# V-Ray standalone run supervisor.
+#
+# Process output, feedback images and process exit are consumed by
+# worker threads and delivered to the caller as events, so the caller
+# only waits on the event queue and checks for cancellation.
+# Every supervisor owns its threads and queue; several renders may be
+# supervised at the same time.
+
+# Python modules
+import queue
+import threading
+import time
+
+
+# Event types
+EVENT_PROGRESS = 'PROGRESS'
+EVENT_IMAGE    = 'IMAGE'
+EVENT_LINE     = 'LINE'
+EVENT_FINISHED = 'FINISHED'
+EVENT_EXIT     = 'EXIT'
+
+# Feedback image polling interval bounds (seconds)
+IMAGE_INTERVAL_MIN = 0.1
+IMAGE_INTERVAL_MAX = 2.0
+
+STARTUP_PHASE = "Startup"
+
+
+# Returns (phase message, progress [0..1] or None, frame finished)
+def parseProgressLine(line):
+    msg  = None
+    prog = None
+
+    if line.find("Building light cache") != -1:
+        msg = "Light cache"
+    elif line.find("Prepass") != -1:
+        prepass_num = line[line.find("Prepass")+7:line.find("of")].strip()
+        msg = "Irradiance map (prepass %s)" % (prepass_num)
+    elif line.find("Rendering image") != -1:
+        msg = "Rendering"
+    elif line.find("Building caustics") != -1:
+        msg = "Caustics"
+    elif line.find("Frame took") != -1:
+        return None, None, True
+
+    if msg is not None:
+        p_start = line.find("...: ") + 5
+        p_end   = line.find("%")
+
+        if p_start != -1 and p_end != -1 and p_end > p_start:
+            p_str = line[p_start:p_end].strip()
+            try:
+                prog = float(p_str) / 100.0
+            except ValueError:
+                pass
+
+    return msg, prog, False
+
+
+class VRaySupervisor():
+    process = None
+
+    # VRayProcess used to request feedback images
+    feedback = None
+    quality  = None
+
+    events  = None
+    threads = None
+
+    # Thread using the feedback process command socket
+    imageThread = None
+
+    # [(phase, start time, end time)]
+    phases = None
+
+    def __init__(self, process, feedback=None, quality=90):
+        self.process  = process
+        self.feedback = feedback
+        self.quality  = quality
+
+        self.events  = queue.Queue()
+        self.threads = []
+        self.phases  = []
+
+        self.stopEvent = threading.Event()
+
+
+    def start(self):
+        self.startTime = time.time()
+        self.setPhase(STARTUP_PHASE)
+
+        targets = [self.waitProcess]
+        if self.process.stdout is not None:
+            targets.append(self.readOutput)
+        if self.feedback is not None:
+            targets.append(self.readImages)
+
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+            if target == self.readImages:
+                self.imageThread = thread
+
+
+    # Stops image requests; on return the feedback command socket
+    # is not used by the supervisor and may be used by the caller
+    def stopImages(self):
+        self.stopEvent.set()
+
+        if self.imageThread is not None and self.imageThread is not threading.current_thread():
+            self.imageThread.join()
+        self.imageThread = None
+
+
+    # Output and exit threads end with the process, so they are only
+    # waited for if the process has already exited
+    def stop(self):
+        self.stopImages()
+
+        if self.process.poll() is not None:
+            for thread in self.threads:
+                if thread is not threading.current_thread():
+                    thread.join(IMAGE_INTERVAL_MAX)
+        self.threads = []
+
+        self.setPhase(None)
+
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+        self.stop()
+
+
+    def setPhase(self, phase):
+        now = time.time()
+        if self.phases and self.phases[-1][2] is None:
+            if self.phases[-1][0] == phase:
+                return
+            name, start, end = self.phases[-1]
+            self.phases[-1] = (name, start, now)
+        if phase is not None:
+            self.phases.append((phase, now, None))
+
+
+    # Returns [(phase, seconds)]
+    def getTimings(self):
+        now = time.time()
+        return [(name, (end if end is not None else now) - start) for name, start, end in self.phases]
+
+
+    # Yields (event type, data) tuples; waits at most 'timeout' for the first one
+    def getEvents(self, timeout=0.1):
+        try:
+            event = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return
+
+        while True:
+            yield event
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+
+
+    def waitProcess(self):
+        returncode = self.process.wait()
+        self.events.put((EVENT_EXIT, returncode))
+
+
+    def readOutput(self):
+        for stdout_line in iter(self.process.stdout.readline, b''):
+            line = stdout_line.decode('ascii', 'replace').strip()
+            if not line:
+                continue
+
+            self.events.put((EVENT_LINE, line))
+
+            msg, prog, finished = parseProgressLine(line)
+            if finished:
+                self.events.put((EVENT_FINISHED, None))
+            elif msg is not None:
+                self.setPhase(msg)
+                self.events.put((EVENT_PROGRESS, (msg, prog)))
+
+            if self.stopEvent.is_set():
+                break
+
+
+    # Requests images from the V-Ray command socket; polls less often
+    # while the image stays the same
+    def readImages(self):
+        interval = IMAGE_INTERVAL_MIN
+        previous = None
+        phase    = None
+
+        while not self.stopEvent.wait(interval):
+            err, jpeg_image = self.feedback.get_image(self.quality)
+            if self.feedback.exit_ready:
+                self.events.put((EVENT_FINISHED, None))
+                break
+
+            if err is None and jpeg_image != previous:
+                previous = jpeg_image
+                interval = IMAGE_INTERVAL_MIN
+                self.events.put((EVENT_IMAGE, jpeg_image))
+            else:
+                interval = min(interval * 2.0, IMAGE_INTERVAL_MAX)
+
+            # New calculation pass started
+            if self.phases and self.phases[-1][0] != phase:
+                phase    = self.phases[-1][0]
+                interval = IMAGE_INTERVAL_MIN
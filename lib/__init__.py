@@ -25,7 +25,14 @@
 # VRay base classes
 
 __all__ = [
+	'AnimationFilter',
+	'ExportFile',
+	'ExportProfiler',
+	'FileCache',
+	'PluginIndex',
+	'VRayPreviewServer',
 	'VRayProxy',
 	'VRaySceneParser',
+	'VRaySupervisor',
 	'VrmatParser',
 ]
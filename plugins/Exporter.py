@@ -92,7 +92,7 @@ def add_properties(rna_pointer):
 
 	VRayExporter.meshExportThreads = IntProperty(
 		name        = "Mesh Export Threads",
-		description = "Mesh Export Threads",
+		description = "Number of geometry files meshes are distributed between (0 - use render threads)",
 		min         = 0,
 		max         = 100,
 		soft_min    = 0,
@@ -100,6 +100,26 @@ def add_properties(rna_pointer):
 		default     = 0
 	)
 
+	VRayExporter.use_compression = BoolProperty(
+		name        = "Compress geometry",
+		description = "Write mesh and hair data lists zlib compressed",
+		default     = False
+	)
+
+	VRayExporter.use_mesh_cache = BoolProperty(
+		name        = "Mesh Cache",
+		description = "Reuse meshes encoded by previous exports if mesh data is not changed",
+		default     = False
+	)
+
+	VRayExporter.mesh_cache_size = IntProperty(
+		name        = "Mesh Cache Size",
+		description = "Mesh cache size limit (Mb)",
+		min         = 1,
+		soft_max    = 16384,
+		default     = 2048
+	)
+
 	VRayExporter.autoclose= BoolProperty(
 		name= "Auto close",
 		description= "Stop render and close VFB on Esc",
@@ -118,6 +138,14 @@ def add_properties(rna_pointer):
 		default     = False
 	)
 
+	VRayExporter.feedback_quality = IntProperty(
+		name        = "Feedback Quality",
+		description = "Render feedback image JPEG quality",
+		min         = 10,
+		max         = 100,
+		default     = 90
+	)
+
 	VRayExporter.use_progress = BoolProperty(
 		name        = "Show progress",
 		description = "Catch and show calculations progress",
@@ -173,6 +201,12 @@ def add_properties(rna_pointer):
 		default= False
 	)
 
+	VRayExporter.use_animation_filter= BoolProperty(
+		name= "Write changes only",
+		description= "Write animated parameters only for frames where they change",
+		default= True
+	)
+
 	VRayExporter.use_hair= BoolProperty(
 		name= "Hair",
 		description= "Render hair",
@@ -203,6 +237,24 @@ def add_properties(rna_pointer):
 		default= False
 	)
 
+	VRayExporter.use_profiler = BoolProperty(
+		name        = "Profile export",
+		description = "Collect export timings and sizes; report is saved next to the scene file",
+		default     = False
+	)
+
+	VRayExporter.use_material_dedup = BoolProperty(
+		name        = "Merge identical materials",
+		description = "Export BRDFs and textures of identical materials only once",
+		default     = False
+	)
+
+	VRayExporter.use_instancer = BoolProperty(
+		name        = "Use Instancer",
+		description = "Export dupli and particle instances with a single Instancer plugin",
+		default     = False
+	)
+
 	VRayExporter.camera_loop= BoolProperty(
 		name= "Camera loop",
 		description= "Render views from all cameras",
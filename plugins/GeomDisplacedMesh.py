@@ -306,7 +306,7 @@ def write(bus):
 		displace_name= get_name(ob, prefix='DOB')
 		GeomDisplacedMesh= ObjectDisplacementOverride
 
-	if not append_unique(bus['cache']['displace'], displace_name):
+	if not bus['cache']['displace'].add(displace_name):
 		return displace_name
 
 	ofile.write("\nGeomDisplacedMesh %s {" % displace_name)
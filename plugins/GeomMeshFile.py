@@ -169,6 +169,18 @@ def add_properties(rna_pointer):
 		default= False
 	)
 
+	# Direct writer output is compared with proxy creator files
+	# by lib/VRayProxy.py compareWithProxyCreator()
+	GeomMeshFile.writer= EnumProperty(
+		name= "Writer",
+		description= "Proxy file writer",
+		items= (
+			('PYTHON',       "Python",        "Write \".vrmesh\" file directly"),
+			('PROXYCREATOR', "Proxy Creator", "Write \".hq\" file and convert it with \"vrayproxycreator\""),
+		),
+		default= 'PYTHON'
+	)
+
 	GeomMeshFile.frame_start= IntProperty(
 		name= "Start frame",
 		description= "Proxy generation start frame",
@@ -228,7 +240,7 @@ def write(bus):
 			proxy_name= "OB%sPR%s" % (clean_string(ob.data.name),
 									  clean_string(proxy_filename))
 
-		if not append_unique(bus['cache']['proxy'], proxy_name):
+		if not bus['cache']['proxy'].add(proxy_name):
 			bus['node']['geometry']= proxy_name
 			return proxy_name
 
@@ -25,6 +25,11 @@
 '''
 
 
+''' Python modules '''
+import array
+import hashlib
+import io
+
 ''' Blender modules '''
 import bpy
 from bpy.props import *
@@ -66,149 +71,251 @@ def add_properties(rna_pointer):
 	)
 
 
-def write_mesh_hex(bus):
-	ofile=   bus['files']['geometry'][0]
-	scene=   bus['scene']
-	ob=      bus['node']['object']
-	me=      bus['node']['mesh']
-	me_name= bus['node']['mesh_name']
+# Bump this when GeomStaticMesh output changes
+# to invalidate mesh cache entries
+CACHE_VERSION= 1
 
-	GeomStaticMesh= ob.data.vray.GeomStaticMesh
-	
-	face_attr = 'faces' if 'faces' in dir(me) else 'polygons'
+# Triangle corners for quads and triangles
+FACE_TRI_QUAD= (0,1,2,2,3,0)
+FACE_TRI=      (0,1,2)
 
-	face_tri= (0,1,2,2,3,0)
-	
-	ofile.write("\nGeomStaticMesh %s {" % me_name)
+# Edge visibility bits for the triangles of a face
+EDGE_VIS_QUAD= (3,3) # "011", "011"
+EDGE_VIS_TRI=  (7,)  # "111"
 
-	ofile.write("\n\tvertices= interpolate((%d, ListVectorHex(\""%(scene.frame_current))
-	for v in me.vertices:
-		for c in v.co:
-			ofile.write(HexFormat(c))
-	ofile.write("\")));")
-
-	ofile.write("\n\tfaces= interpolate((%d, ListIntHex(\""%(scene.frame_current))
-	for f in getattr(me, face_attr):
-		if len(f.vertices) == 4:
-			for i in face_tri:
-				ofile.write(HexFormat(f.vertices[i]))
-		else:
-			for v in f.vertices:
-				ofile.write(HexFormat(v))
-	ofile.write("\")));")
-
-	ofile.write("\n\tface_mtlIDs= ListIntHex(\"")
-	for f in getattr(me, face_attr):
-		if len(f.vertices) == 4:
-			ofile.write(HexFormat(f.material_index + 1))
-			ofile.write(HexFormat(f.material_index + 1))
-		else:
-			ofile.write(HexFormat(f.material_index + 1))
-	ofile.write("\");")
 
-	ofile.write("\n\tnormals= interpolate((%d, ListVectorHex(\""%(scene.frame_current))
-	for f in getattr(me, face_attr):
-		if len(f.vertices) == 4:
-			vertices= face_tri
+# Returns tessellated faces collection
+def get_mesh_faces(me):
+	if hasattr(me, 'tessfaces'):
+		if not len(me.tessfaces) and len(me.polygons):
+			me.calc_tessface()
+		return me.tessfaces
+	return me.faces
+
+
+# Reads raw mesh data into flat arrays with foreach_get().
+# This is the only part that touches Blender API.
+def get_mesh_buffers(me, uvs):
+	faces=  get_mesh_faces(me)
+	nVerts= len(me.vertices)
+	nFaces= len(faces)
+
+	buffers= {}
+
+	buffers['vertices']= array.array('f', [0.0]) * (nVerts * 3)
+	me.vertices.foreach_get('co', buffers['vertices'])
+
+	buffers['vertNormals']= array.array('f', [0.0]) * (nVerts * 3)
+	me.vertices.foreach_get('normal', buffers['vertNormals'])
+
+	buffers['faceVerts']= array.array('i', [0]) * (nFaces * 4)
+	faces.foreach_get('vertices_raw', buffers['faceVerts'])
+
+	buffers['faceNormals']= array.array('f', [0.0]) * (nFaces * 3)
+	faces.foreach_get('normal', buffers['faceNormals'])
+
+	buffers['faceMtls']= array.array('i', [0]) * nFaces
+	faces.foreach_get('material_index', buffers['faceMtls'])
+
+	buffers['faceSmooth']= array.array('b', [0]) * nFaces
+	faces.foreach_get('use_smooth', buffers['faceSmooth'])
+
+	uv_textures= me.tessface_uv_textures if 'tessface_uv_textures' in dir(me) else me.uv_textures
+
+	buffers['faceUVs']= []
+	for uv_texture in uv_textures:
+		faceUVs= array.array('f', [0.0]) * (nFaces * 8)
+		uv_texture.data.foreach_get('uv_raw', faceUVs)
+		buffers['faceUVs'].append((uv_texture.name, get_uv_layer_id(uvs, uv_texture.name), faceUVs))
+
+	return buffers
+
+
+# Number of triangles the mesh will be exported with
+def get_mesh_triangles(buffers):
+	nFaces= len(buffers['faceMtls'])
+	nTris=  buffers['faceVerts'][3::4].count(0)
+	return nTris + (nFaces - nTris) * 2
+
+
+# Hash of the mesh buffers and everything else that gets
+# into the GeomStaticMesh block
+def get_mesh_hash(buffers, me_name, frame, params, signature=None):
+	h= hashlib.sha1()
+	h.update(repr((CACHE_VERSION, me_name, frame, params, signature)).encode('utf-8'))
+	for key in ('vertices', 'vertNormals', 'faceVerts', 'faceNormals', 'faceMtls', 'faceSmooth'):
+		h.update(memoryview(buffers[key]))
+	for uv_name, uv_index, faceUVs in buffers['faceUVs']:
+		h.update(repr((uv_name, uv_index)).encode('utf-8'))
+		h.update(memoryview(faceUVs))
+	return h.hexdigest()
+
+
+# Builds GeomStaticMesh channels from get_mesh_buffers() result
+def get_mesh_data(buffers):
+	vertNormals= buffers['vertNormals']
+	faceVerts=   buffers['faceVerts']
+	faceNormals= buffers['faceNormals']
+	faceMtls=    buffers['faceMtls']
+	faceSmooth=  buffers['faceSmooth']
+
+	nFaces= len(faceMtls)
+
+	triFaces=   array.array('i')
+	triMtls=    array.array('i')
+	triNormals= array.array('f')
+	edgeVis=    array.array('i')
+
+	ev= 0 # Packed edge visibility bits
+	k=  0 # Triangles in 'ev'
+
+	for f in range(nFaces):
+		fv= faceVerts[4*f:4*f+4]
+		if fv[3]:
+			corners= FACE_TRI_QUAD
+			fev=     EDGE_VIS_QUAD
 		else:
-			vertices= (0,1,2)
+			corners= FACE_TRI
+			fev=     EDGE_VIS_TRI
 
-		for v in vertices:
-			if f.use_smooth:
-				for c in me.vertices[f.vertices[v]].normal:
-					ofile.write(HexFormat(c))
+		mtlID= faceMtls[f] + 1
+
+		for i in corners:
+			v= fv[i]
+			triFaces.append(v)
+			if faceSmooth[f]:
+				triNormals.extend(vertNormals[3*v:3*v+3])
 			else:
-				for c in f.normal:
-					ofile.write(HexFormat(c))
-	ofile.write("\")));")
-
-	ofile.write("\n\tfaceNormals= ListIntHex(\"")
-	k= 0
-	for f in getattr(me, face_attr):
-		if len(f.vertices) == 4:
-			vertices= 6
-		else:
-			vertices= 3
+				triNormals.extend(faceNormals[3*f:3*f+3])
 
-		for v in range(vertices):
-			ofile.write(HexFormat(k))
+		for bits in fev:
+			triMtls.append(mtlID)
+			ev= (ev << 3) | bits
 			k+= 1
-	ofile.write("\");")
+			if k == 10:
+				edgeVis.append(ev)
+				ev= 0
+				k=  0
+	if k:
+		edgeVis.append(ev)
+
+	mapChannels= []
+	for uv_name, uv_index, faceUVs in buffers['faceUVs']:
+		uvVerts= array.array('f')
+		uvFaces= array.array('i')
+
+		k= 0
+		for f in range(nFaces):
+			if faceVerts[4*f+3]:
+				n=       4
+				corners= FACE_TRI_QUAD
+			else:
+				n=       3
+				corners= FACE_TRI
+			for i in range(n):
+				uvVerts.extend(faceUVs[8*f+2*i:8*f+2*i+2])
+				uvVerts.append(0.0)
+			uvFaces.extend([k+i for i in corners])
+			k+= n
 
+		mapChannels.append((uv_name, uv_index, uvVerts, uvFaces))
 
-	def edge_visibility(k, ev):
-		if k == 9:
-			ofile.write(HexFormat(int(ev, 2)))
-			return 0, ""
-		return k + 1, ev
+	return {
+		'vertices':        buffers['vertices'],
+		'faces':           triFaces,
+		'face_mtlIDs':     triMtls,
+		'normals':         triNormals,
+		'faceNormals':     array.array('i', range(len(triFaces))),
+		'edge_visibility': edgeVis,
+		'map_channels':    mapChannels,
+	}
 
-	ofile.write("\n\tedge_visibility= ListIntHex(\"")
 
-	k= 0
-	ev= ""
-	if len(getattr(me, face_attr)) < 5:
-		for f in getattr(me, face_attr):
-			if len(f.vertices) == 4:
-				ev+= "011011"
-			else:
-				ev+= "111"
-		edge_visibility(k, ev)
-	else:
-		k= 0;
-		for f in getattr(me, face_attr):
-			if len(f.vertices) == 4:
-				ev+= "011"
-				k, ev = edge_visibility(k, ev)
-				ev+= "011"
-				k, ev = edge_visibility(k, ev)
-			else:
-				ev+= "111"
-				k, ev = edge_visibility(k, ev)
-		if k:
-			edge_visibility(k, ev)
-	ofile.write("\");")
+# Encodes GeomStaticMesh block from get_mesh_buffers() result.
+# 'params' are already formatted plugin parameters.
+# Doesn't use Blender API, so could be called from a worker process.
+def encode_mesh_data(me_name, buffers, frame, params, compress=False):
+	ofile= io.StringIO()
 
-	uv_textures = me.tessface_uv_textures if 'tessface_uv_textures' in dir(me) else me.uv_textures
+	data= get_mesh_data(buffers)
 
-	if len(uv_textures):
-		ofile.write("\n\tmap_channels= List(")
+	HexFormatList= ZipHexFormatArray if compress else HexFormatArray
 
-		for uv_texture_idx,uv_texture in enumerate(uv_textures):
-			if uv_texture_idx:
+	ofile.write("\nGeomStaticMesh %s {" % me_name)
+	ofile.write("\n\tvertices= interpolate((%d, ListVectorHex(\"%s\")));" % (frame, HexFormatList(data['vertices'], 'f')))
+	ofile.write("\n\tfaces= interpolate((%d, ListIntHex(\"%s\")));" % (frame, HexFormatList(data['faces'], 'i')))
+	ofile.write("\n\tface_mtlIDs= ListIntHex(\"%s\");" % HexFormatList(data['face_mtlIDs'], 'i'))
+	ofile.write("\n\tnormals= interpolate((%d, ListVectorHex(\"%s\")));" % (frame, HexFormatList(data['normals'], 'f')))
+	ofile.write("\n\tfaceNormals= ListIntHex(\"%s\");" % HexFormatList(data['faceNormals'], 'i'))
+	ofile.write("\n\tedge_visibility= ListIntHex(\"%s\");" % HexFormatList(data['edge_visibility'], 'i'))
+
+	if len(data['map_channels']):
+		ofile.write("\n\tmap_channels= List(")
+		for i,(uv_name, uv_index, uv_vertices, uv_faces) in enumerate(data['map_channels']):
+			if i:
 				ofile.write(",")
+			ofile.write("\n\t\t// %s" % uv_name)
+			ofile.write("\n\t\tList(%d,ListVectorHex(\"%s\"),ListIntHex(\"%s\"))" % (uv_index,
+																						HexFormatList(uv_vertices, 'f'),
+																						HexFormatList(uv_faces, 'i')))
+		ofile.write(");")
 
-			uv_layer_index= get_uv_layer_id(bus['uvs'], uv_texture.name)
+	for param,value in params:
+		ofile.write("\n\t%s= %s;" % (param, value))
 
-			ofile.write("\n\t\t// %s"%(uv_texture.name))
-			ofile.write("\n\t\tList(%d,ListVectorHex(\""%(uv_layer_index))
+	ofile.write("\n}\n")
 
-			for face in uv_texture.data:
-				for uv in face.uv:
-					ofile.write(HexFormat(uv[0]))
-					ofile.write(HexFormat(uv[1]))
-					ofile.write(HexFormat(0.0))
+	return ofile.getvalue()
 
-			ofile.write("\"),ListIntHex(\"")
 
-			k= 0
-			for face in uv_texture.data:
-				if len(face.uv) == 4:
-					for i in face_tri:
-						ofile.write(HexFormat(k+i))
-					k+= 4
-				else:
-					for i in (0,1,2):
-						ofile.write(HexFormat(k+i))
-					k+= 3
-			ofile.write("\"))")
+# Writes GeomStaticMesh block, encoded or taken from the cache.
+# Doesn't use Blender API, so could be called from a thread.
+def write_mesh_data(ofile, me_name, buffers, frame, params, cache=None, cache_key=None, compress=False):
+	if cache is not None:
+		block= cache.get(cache_key)
+		if block is not None:
+			ofile.write(block.decode('utf-8'))
+			return
 
-		ofile.write(");")
+	block= encode_mesh_data(me_name, buffers, frame, params, compress)
 
-	for param in PARAMS:
-		value= getattr(GeomStaticMesh, param)
-		ofile.write("\n\t%s= %s;"%(param, a(scene, value)))
+	# Write output first: cache failure must never drop geometry
+	ofile.write(block)
+	if cache is not None:
+		cache.put(cache_key, block.encode('utf-8'))
 
-	ofile.write("\n}\n")
+
+# Modifier stack description used as a part of the cache key
+def get_modifiers_signature(ob):
+	return tuple((md.name, md.type, md.show_render) for md in ob.modifiers)
+
+
+def write_mesh_hex(bus):
+	ofile=   bus['files']['geometry'][0]
+	scene=   bus['scene']
+	ob=      bus['node']['object']
+	me=      bus['node']['mesh']
+	me_name= bus['node']['mesh_name']
+
+	GeomStaticMesh= ob.data.vray.GeomStaticMesh
+
+	frame=  scene.frame_current
+	params= [(param, a(scene, getattr(GeomStaticMesh, param))) for param in PARAMS]
+
+	buffers= get_mesh_buffers(me, bus['uvs'])
+
+	compress= scene.vray.exporter.use_compression
+
+	cache=     bus.get('mesh_cache')
+	cache_key= None
+	if cache is not None:
+		cache_key= get_mesh_hash(buffers, me_name, frame, params, (get_modifiers_signature(ob), compress))
+
+	# Threaded export: data is written by the geometry file writer
+	if 'geometry_writer' in bus:
+		bus['geometry_writer'](me_name, buffers, frame, params, cache, cache_key, compress)
+	else:
+		write_mesh_data(ofile, me_name, buffers, frame, params, cache, cache_key, compress)
 
 
 def write(bus):
@@ -141,7 +141,7 @@ def write(bus):
 			subdiv_name= get_name(ob, prefix='SBDVDOB')
 			GeomDisplacedMesh= ObjectDisplacementOverride
 
-		if not append_unique(bus['cache']['displace'], subdiv_name):
+		if not bus['cache']['displace'].add(subdiv_name):
 			return subdiv_name
 
 		ofile.write("\nGeomStaticSmoothedMesh %s {" % subdiv_name)
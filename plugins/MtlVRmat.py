@@ -87,8 +87,16 @@ def write(bus, name):
 
     MtlVRmat = ma.vray.MtlVRmat
 
+    filepath = utils.get_full_filepath(bus, None, MtlVRmat.filename)
+
+    # Check the file that is written to the scene; skip the check if it
+    # is missing or couldn't be read
+    pluginIndex = utils.get_plugin_index()
+    if MtlVRmat.mtlname and pluginIndex.getPlugins(filepath) is not None and MtlVRmat.mtlname not in pluginIndex.getMaterialsNames(filepath):
+        utils.debug(bus['scene'], "Material \"%s\" is not found in \"%s\"!" % (MtlVRmat.mtlname, MtlVRmat.filename), error=True)
+
     ofile.write("\nMtlVRmat %s {" % name)
-    ofile.write('\n\tfilename="%s";' % utils.get_full_filepath(bus, None, MtlVRmat.filename))
+    ofile.write('\n\tfilename="%s";' % filepath)
     ofile.write('\n\tmtlname="%s";'  % MtlVRmat.mtlname)
     ofile.write("\n}\n")
 
@@ -178,7 +178,7 @@ def write_BitmapBuffer(bus):
 	bitmap_name= 'IM' + clean_string(texture.image.name)
 
 	# Check if already exported
-	if not append_unique(bus['cache']['bitmap'], bitmap_name):
+	if not bus['cache']['bitmap'].add(bitmap_name):
 		return bitmap_name
 
 	ofile.write("\nBitmapBuffer %s {" % bitmap_name)
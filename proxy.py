@@ -26,18 +26,25 @@
 
 
 ''' Python modules  '''
+import array
+import collections
 import math
+import multiprocessing
 import os
 import subprocess
 import sys
 import tempfile
 import time
 
+from concurrent.futures.process import BrokenProcessPool
+
 ''' Blender modules '''
 import bpy
 
 ''' vb modules '''
 from vb25.utils import *
+from vb25.plugins import *
+from vb25.lib import VRayProxy
 
 
 def write_mesh_hq(ofile, sce, ob):
@@ -116,3 +123,159 @@ def generate_proxy(sce, ob, vrmesh, append=False):
 	hq_file.close()
 	proxy_creator(hq_file.name, vrmesh, append)
 	os.remove(hq_file.name)
+
+
+# Collects proxy mesh data for the current frame.
+# Only this part uses Blender API.
+def get_proxy_mesh_buffers(sce, ob):
+	GeomStaticMesh= PLUGINS['GEOMETRY']['GeomStaticMesh']
+	GeomMeshFile=   ob.data.vray.GeomMeshFile
+
+	me= ob.to_mesh(sce, True, 'RENDER')
+
+	if GeomMeshFile.apply_transforms:
+		me.transform(ob.matrix_world)
+
+	buffers= GeomStaticMesh.get_mesh_buffers(me, {})
+
+	# Proxy stores only the first UV layer
+	buffers['faceUVs']= buffers['faceUVs'][:1]
+
+	# Vertices of the next frame for velocity
+	buffers['nextVertices']= None
+
+	bpy.data.meshes.remove(me)
+
+	return buffers
+
+
+# Encodes .vrmesh frame voxels from get_proxy_mesh_buffers() result.
+# Doesn't use Blender API, so could be called from a worker process.
+def encode_proxy_frame(buffers):
+	GeomStaticMesh= PLUGINS['GEOMETRY']['GeomStaticMesh']
+
+	mesh= GeomStaticMesh.get_mesh_data(buffers)
+
+	uvs=     None
+	uvFaces= None
+	if mesh['map_channels']:
+		uv_name, uv_index, uvs, uvFaces= mesh['map_channels'][0]
+
+	vertices=     buffers['vertices']
+	nextVertices= buffers['nextVertices']
+
+	velocities= None
+	if nextVertices is not None and len(nextVertices) == len(vertices):
+		velocities= array.array('f', [dc-c for c,dc in zip(vertices, nextVertices)])
+
+	voxels= VRayProxy.encodeGeometryVoxels(
+		mesh['vertices'],
+		mesh['faces'],
+		normals=     mesh['normals'],
+		normalFaces= mesh['faceNormals'],
+		uvs=         uvs,
+		uvFaces=     uvFaces,
+		velocities=  velocities,
+		mtlIDs=      mesh['face_mtlIDs'],
+	)
+	voxels.append(VRayProxy.encodePreviewVoxel(mesh['vertices'], mesh['faces']))
+
+	return voxels
+
+
+# Writes .vrmesh files directly without .hq file and proxy creator.
+# 'proxies' is a list of (object, .vrmesh filepath, frames or None).
+# Meshes are evaluated here object by object and frame by frame;
+# encoding and compression of evaluated frames of all objects run in
+# one process pool, encoded frames are written in order.
+# If a worker process fails its frame is encoded in-process; on any
+# other error partially written files are removed.
+def write_vrmesh_files(sce, proxies):
+	timer= time.clock()
+
+	selected_frame= sce.frame_current
+
+	frames_count= sum(len(frames) if frames is not None else 1 for ob,vrmesh,frames in proxies)
+
+	workers= min(frames_count, multiprocessing.cpu_count())
+	pool=    get_process_pool(workers)
+
+	# Limits evaluated meshes waiting for encoding
+	max_pending= 2 * workers if pool else 0
+	pending= collections.deque()
+
+	writers= []
+
+	def write_frame(job):
+		writer, buffers, future= job
+		if future is not None:
+			try:
+				writer.writeFrame(future.result())
+				return
+			except BrokenProcessPool:
+				debug(sce, "Proxy worker process failed; encoding frame in-process", error=True)
+		writer.writeFrame(encode_proxy_frame(buffers))
+
+	def add_frame(writer, buffers):
+		future= None
+		if pool:
+			try:
+				future= pool.submit(encode_proxy_frame, buffers)
+			except BrokenProcessPool:
+				pass
+		pending.append((writer, buffers, future))
+		while len(pending) > max_pending:
+			write_frame(pending.popleft())
+
+	try:
+		for ob,vrmesh,frames in proxies:
+			GeomMeshFile= ob.data.vray.GeomMeshFile
+
+			if frames is None:
+				frames= [selected_frame]
+
+			add_velocity= GeomMeshFile.animation and GeomMeshFile.add_velocity
+
+			writer= VRayProxy.MeshFileWriter(vrmesh)
+			writers.append(writer)
+
+			buffers= None
+			for frame in frames:
+				if frame != sce.frame_current:
+					sce.frame_set(frame)
+				debug(sce, "Generating VRayProxy (Frame: %i; File: %s)..." % (frame, vrmesh))
+
+				next_buffers= get_proxy_mesh_buffers(sce, ob)
+				if buffers is not None:
+					if add_velocity:
+						buffers['nextVertices']= next_buffers['vertices']
+					add_frame(writer, buffers)
+				buffers= next_buffers
+
+			if add_velocity and sce.frame_current != sce.frame_end:
+				sce.frame_set(sce.frame_current+1)
+				buffers['nextVertices']= get_proxy_mesh_buffers(sce, ob)['vertices']
+			add_frame(writer, buffers)
+
+		while pending:
+			write_frame(pending.popleft())
+
+		for writer in writers:
+			writer.close()
+
+	except:
+		for writer in writers:
+			writer.abort()
+		raise
+
+	finally:
+		if pool:
+			pool.shutdown(wait=False)
+		if sce.frame_current != selected_frame:
+			sce.frame_set(selected_frame)
+
+	debug(sce, "Generating VRayProxy done [%.2f]" % (time.clock() - timer))
+
+
+def write_vrmesh(sce, ob, vrmesh, frames=None):
+	write_vrmesh_files(sce, [(ob, vrmesh, list(frames) if frames is not None else None)])
@@ -26,6 +26,10 @@
 
 
 ''' Python modules  '''
+import array
+import glob
+import hashlib
+import io
 import math
 import os
 import string
@@ -34,10 +38,14 @@ import sys
 import tempfile
 import time
 import random
+import re
 
 import threading
 from threading import Timer
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 
 ''' Blender modules '''
 import bpy
@@ -45,7 +53,13 @@ import mathutils
 
 ''' vb modules '''
 import vb25
-from vb25.lib     import VRayProcess
+from vb25.lib.VRayProcess import VRayProcess
+from vb25.lib.VRayPreviewServer import PreviewServer
+from vb25.lib.VRaySupervisor import VRaySupervisor, EVENT_IMAGE, EVENT_PROGRESS, EVENT_LINE, EVENT_FINISHED, EVENT_EXIT
+from vb25.lib.AnimationFilter import AnimationFilter
+from vb25.lib.ExportFile import ExportFile
+from vb25.lib.ExportProfiler import ExportProfiler, measure
+from vb25.lib.FileCache import FileCache
 from vb25.utils   import *
 from vb25.plugins import *
 from vb25.texture import *
@@ -315,16 +329,24 @@ LIGHT_PARAMS= { # TEMP! REMOVE!
 '''
   MESHES
 '''
+def get_mesh_export_threads(scene):
+	VRayExporter= scene.vray.exporter
+	if VRayExporter.meshExportThreads:
+		return VRayExporter.meshExportThreads
+	return scene.render.threads
+
+
 def write_geometry_python(bus):
 	scene= bus['scene']
 
 	VRayScene= scene.vray
 	VRayExporter= VRayScene.exporter
 
+	GeomStaticMesh= PLUGINS['GEOMETRY']['GeomStaticMesh']
+
 	def write_frame(bus):
 		# Filters stores already exported data
-		bus['filter']= {}
-		bus['filter']['mesh']= []
+		bus['filter']= init_export_cache('mesh')
 
 		for ob in scene.objects:
 			if ob.type not in GEOM_TYPES:
@@ -345,9 +367,9 @@ def write_geometry_python(bus):
 			mesh_name= get_name(ob.data, prefix='ME')
 
 			if VRayExporter.use_instances:
-				if mesh_name in bus['filter']['mesh']:
+				if not bus['filter']['mesh'].add(mesh_name):
+					bpy.data.meshes.remove(mesh)
 					continue
-				bus['filter']['mesh'].append(mesh_name)
 			else:
 				mesh_name= get_name(ob, prefix='ME')
 
@@ -358,32 +380,127 @@ def write_geometry_python(bus):
 			bus['node']['mesh']= mesh
 			bus['node']['mesh_name']= mesh_name
 
-			PLUGINS['GEOMETRY']['GeomStaticMesh'].write(bus)
+			GeomStaticMesh.write(bus)
+
+			# Mesh data is already copied to the buffers
+			bpy.data.meshes.remove(mesh)
 
 	# Output files
+	threadCount= get_mesh_export_threads(scene)
+
+	# Files actually written by this export (older exports may leave more)
+	bus['geometry_filepaths']= [bus['filenames']['geometry'][:-11]+"_%.2i.vrscene"%(thread) for thread in range(threadCount)]
+
 	bus['files']['geometry']= []
-	for thread in range(scene.render.threads):
-		bus['files']['geometry'].append(open(bus['filenames']['geometry'][:-11]+"_%.2i.vrscene"%(thread), 'w'))
+	for filepath in bus['geometry_filepaths']:
+		bus['files']['geometry'].append(open(filepath, 'w'))
 
 	for geometry_file in bus['files']['geometry']:
 		geometry_file.write("// V-Ray/Blender %s" % VERSION)
 		geometry_file.write("\n// Geometry file\n")
 
+	# Meshes are evaluated in the main thread (Blender API is not thread safe).
+	# Triangulation, hex encoding and compression are pure Python and hold
+	# the GIL, so they run in a process pool; encoded blocks are written in
+	# order by one writer thread per geometry file.
+	# Meshes are distributed between files by triangle count.
+	# Without a process pool (see get_process_pool()) writer threads also
+	# encode the meshes, that only shards the output and runs on one core.
+	workers=    scene.render.threads
+	pool=       get_process_pool(workers)
+	writers=    [ThreadPoolExecutor(max_workers=1) for thread in range(threadCount)]
+	jobs=       []
+	load=       [0] * threadCount
+	mesh_files= {}
+
+	# Limits amount of mesh data waiting for encoding and writing
+	pending= threading.BoundedSemaphore(max(threadCount, workers) * 2)
+
+	def write_mesh_block(ofile, block, future, args, cache, cache_key):
+		if block is not None:
+			ofile.write(block.decode('utf-8'))
+			return
+
+		if future is not None:
+			try:
+				block= future.result()
+			except BrokenProcessPool:
+				debug(scene, "Mesh encoder process failed; encoding mesh in-process", error=True)
+
+		if block is None:
+			block= GeomStaticMesh.encode_mesh_data(*args)
+
+		# Write output first: cache failure must never drop geometry
+		ofile.write(block)
+		if cache is not None:
+			cache.put(cache_key, block.encode('utf-8'))
+
+	def write_mesh(me_name, buffers, frame, params, cache, cache_key, compress):
+		# Keep all frames of the mesh in the same file
+		if me_name in mesh_files:
+			thread= mesh_files[me_name]
+		else:
+			thread= load.index(min(load))
+			mesh_files[me_name]= thread
+		load[thread]+= GeomStaticMesh.get_mesh_triangles(buffers)
+
+		args= (me_name, buffers, frame, params, compress)
+
+		pending.acquire()
+
+		block= cache.get(cache_key) if cache is not None else None
+
+		future= None
+		if block is None and pool is not None:
+			try:
+				future= pool.submit(GeomStaticMesh.encode_mesh_data, *args)
+			except BrokenProcessPool:
+				pass
+
+		job= writers[thread].submit(write_mesh_block, bus['files']['geometry'][thread], block, future, args, cache, cache_key)
+		job.add_done_callback(lambda job: pending.release())
+		jobs.append(job)
+
+	bus['geometry_writer']= write_mesh
+
+	# Already encoded meshes from previous exports
+	bus['mesh_cache']= None
+	if VRayExporter.use_mesh_cache:
+		bus['mesh_cache']= FileCache(get_cache_dir('meshes'), VRayExporter.mesh_cache_size * 1024 * 1024)
+
 	timer= time.clock()
 	debug(scene, "Writing meshes...")
 
-	if VRayExporter.animation and VRayExporter.animation_type == 'FULL' and not VRayExporter.camera_loop:
-		cur_frame= scene.frame_current
-		scene.frame_set(scene.frame_start)
-		f= scene.frame_start
-		while(f <= scene.frame_end):
-			exported_meshes= []
-			scene.frame_set(f)
+	try:
+		if VRayExporter.animation and VRayExporter.animation_type == 'FULL' and not VRayExporter.camera_loop:
+			cur_frame= scene.frame_current
+			scene.frame_set(scene.frame_start)
+			f= scene.frame_start
+			while(f <= scene.frame_end):
+				exported_meshes= []
+				scene.frame_set(f)
+				write_frame(bus)
+				f+= scene.frame_step
+			scene.frame_set(cur_frame)
+		else:
 			write_frame(bus)
-			f+= scene.frame_step
-		scene.frame_set(cur_frame)
-	else:
-		write_frame(bus)
+	finally:
+		for writer in writers:
+			writer.shutdown(wait=True)
+		if pool is not None:
+			pool.shutdown(wait=True)
+		del bus['geometry_writer']
+
+	for job in jobs:
+		err= job.exception()
+		if err is not None:
+			debug(scene, "Mesh write error: %s" % err, error= True)
+
+	if bus['mesh_cache'] is not None:
+		debug(scene, "Mesh cache: %i hits, %i misses, %s used" % (bus['mesh_cache'].hits, bus['mesh_cache'].misses, GetStrSize(bus['mesh_cache'].size)))
+		if bus.get('profiler'):
+			bus['profiler'].addCaches({'mesh_cache': bus['mesh_cache']})
+	del bus['mesh_cache']
 
 	for geometry_file in bus['files']['geometry']:
 		geometry_file.write("\n// vim: set syntax=on syntax=c:\n\n")
@@ -423,6 +540,23 @@ def write_geometry(bus):
 		write_geometry_python(bus)
 
 
+# Hair widths along the strand for the number of hair keys
+def get_hair_widths(VRayFur, segments, preview):
+	if preview:
+		return array.array('f', [0.01]) * segments
+
+	width= VRayFur.width / 2.0
+
+	if not VRayFur.make_thinner:
+		return array.array('f', [width]) * segments
+
+	thin_start= int(VRayFur.thin_start / 100 * segments)
+	thin_segments= segments - thin_start
+	thin_step= width / (thin_segments + 1)
+
+	return array.array('f', [width - thin_step * max(0, s - thin_start) for s in range(segments)])
+
+
 def write_GeomMayaHair(bus, ps, hair_geom_name):
 	scene= bus['scene']
 	ofile= bus['files']['nodes']
@@ -430,37 +564,71 @@ def write_GeomMayaHair(bus, ps, hair_geom_name):
 
 	VRayFur= ps.settings.vray.VRayFur
 
-	num_hair_vertices= []
-	hair_vertices=     []
-	widths=            []
-
-	for p,particle in enumerate(ps.particles):
-		sys.stdout.write("%s: Object: %s => Hair: %s\r" % (color("V-Ray/Blender", 'green'), color(ob.name,'yellow'), color(p, 'green')))
-		sys.stdout.flush()
-
-		segments= len(particle.hair_keys)
-		num_hair_vertices.append( HexFormat(segments) )
-
-		width= VRayFur.width / 2.0
-		thin_start= int(VRayFur.thin_start / 100 * segments)
-		thin_segments= segments - thin_start
-		thin_step= width / (thin_segments + 1)
-		for s,segment in enumerate(particle.hair_keys):
-			for c in segment.co:
-				hair_vertices.append( HexFormat(c) )
-			if bus['preview']:
-				widths.append( HexFormat(0.01) )
-			else:
-				if VRayFur.make_thinner:
-					if s > thin_start:
-						width-= thin_step
-				widths.append( HexFormat(width) )
-
-	ofile.write("\nGeomMayaHair %s {" % hair_geom_name)
-	ofile.write("\n\tnum_hair_vertices= interpolate((%d,ListIntHex(\"%s\")));"%(scene.frame_current, ''.join(num_hair_vertices)))
-	ofile.write("\n\thair_vertices= interpolate((%d,ListVectorHex(\"%s\")));"%(scene.frame_current,  ''.join(hair_vertices)))
-	ofile.write("\n\twidths= interpolate((%d,ListFloatHex(\"%s\")));"%(scene.frame_current,          ''.join(widths)))
-	ofile.write("\n}\n")
+	particles= ps.particles
+
+	num_hair_vertices= array.array('i', [0]) * len(particles)
+	hair_vertices=     array.array('f')
+	widths=            array.array('f')
+
+	# Widths depend only on the keys count
+	strand_widths= {}
+
+	# Key coordinates buffers by the keys count.
+	# Hair keys are only accessible per particle, so there is still
+	# one foreach_get() call per strand.
+	strand_buffers= {}
+
+	report_time= time.time()
+
+	for p,particle in enumerate(particles):
+		hair_keys= particle.hair_keys
+		segments=  len(hair_keys)
+
+		num_hair_vertices[p]= segments
+
+		if segments not in strand_buffers:
+			strand_buffers[segments]= array.array('f', [0.0]) * (segments * 3)
+		co= strand_buffers[segments]
+		hair_keys.foreach_get('co', co)
+		hair_vertices.extend(co)
+
+		if segments not in strand_widths:
+			strand_widths[segments]= get_hair_widths(VRayFur, segments, bus['preview'])
+		widths.extend(strand_widths[segments])
+
+		# Report progress a few times per second
+		if not p % 256 and time.time() - report_time > 0.25:
+			report_time= time.time()
+			sys.stdout.write("%s: Object: %s => Hair: %s\r" % (color("V-Ray/Blender", 'green'), color(ob.name,'yellow'), color(p, 'green')))
+			sys.stdout.flush()
+
+	hair_lists= ((num_hair_vertices, 'i'), (hair_vertices, 'f'), (widths, 'f'))
+
+	# Compressed lists are encoded by the frame hair writer threads
+	# and written at the end of the frame (see write_hair_jobs())
+	if bus.get('hair_writer'):
+		jobs= [bus['hair_writer'].submit(ZipHexFormatArray, values, typecode) for values,typecode in hair_lists]
+		bus['hair_jobs'].append((ofile, hair_geom_name, scene.frame_current, jobs))
+		return
+
+	HexFormatList= ZipHexFormatArray if scene.vray.exporter.use_compression else HexFormatArray
+
+	write_GeomMayaHair_data(ofile, hair_geom_name, scene.frame_current, [HexFormatList(values, typecode) for values,typecode in hair_lists])
+
+
+def write_GeomMayaHair_data(ofile, hair_geom_name, frame, hex_lists):
+	ofile.writePlugin('GeomMayaHair', hair_geom_name, (
+		('num_hair_vertices', "interpolate((%d,ListIntHex(\"%s\")))"    % (frame, hex_lists[0])),
+		('hair_vertices',     "interpolate((%d,ListVectorHex(\"%s\")))"  % (frame, hex_lists[1])),
+		('widths',            "interpolate((%d,ListFloatHex(\"%s\")))"   % (frame, hex_lists[2])),
+	))
+
+
+# Writes GeomMayaHair plugins compressed by the hair writer threads
+def write_hair_jobs(bus):
+	for ofile, hair_geom_name, frame, jobs in bus['hair_jobs']:
+		write_GeomMayaHair_data(ofile, hair_geom_name, frame, [job.result() for job in jobs])
+	bus['hair_jobs']= []
 
 
 '''
@@ -477,9 +645,7 @@ def write_settings(bus):
 	SettingsOptions = VRayScene.SettingsOptions
 	Includer        = VRayScene.Includer
 
-	threadCount = scene.render.threads
-	if VRayExporter.meshExportThreads:
-		threadCount = VRayExporter.meshExportThreads
+	threadCount = get_mesh_export_threads(scene)
 
 	PLUGINS['CAMERA']['SettingsCamera'].write(bus)
 	PLUGINS['CAMERA']['SettingsMotionBlur'].write(bus)
@@ -647,7 +813,140 @@ def write_lamp_textures(bus):
 	return bus['lamp_textures']
 
 
-def	write_material(bus):
+# Plugin block as written by material and texture writers:
+# type, name, rest of the header line (comment) and parameters
+MATERIAL_BLOCK_RE = re.compile(r'\n([A-Za-z]\w*)[ \t]+(\w+)[ \t]*\{([^\n]*)(.*?)\n\}\n', re.S)
+# Parameter value up to ';' outside of quoted strings
+PARAM_VALUE_RE    = re.compile(r'(\n[ \t]*\w+[ \t]*=)((?:[^;"]|"(?:[^"\\]|\\.)*")*);')
+# Quoted string or identifier inside a parameter value
+VALUE_TOKEN_RE    = re.compile(r'"(?:[^"\\]|\\.)*"|\w+')
+
+def get_reference_names(params):
+	names= []
+	for m in PARAM_VALUE_RE.finditer(params):
+		names.extend(t for t in VALUE_TOKEN_RE.findall(m.group(2)) if t[0] != '"')
+	return names
+
+
+# Replaces plugin references in parameter values with 'aliases';
+# parameter names and quoted strings are kept as is
+def rewrite_material_aliases(aliases, params):
+	if not aliases:
+		return params
+	def rewrite_value(m):
+		return aliases.get(m.group(0), m.group(0))
+	def rewrite_param(m):
+		return "%s%s;" % (m.group(1), VALUE_TOKEN_RE.sub(rewrite_value, m.group(2)))
+	return PARAM_VALUE_RE.sub(rewrite_param, params)
+
+
+# Material sub-plugins (BRDFs, textures, UVW generators) are named after
+# the material. Each of them that is the same as an already exported
+# plugin apart from the name is dropped and referenced by the existing
+# name. Blocks are compared after their own references are rewritten,
+# so a texture is merged only if its inputs are merged too. Material
+# plugins themselves are kept, so material names stay valid.
+# Returns (texts, [{ plugin type : dropped blocks count }] per text).
+def dedup_material_blocks(bus, token, ma_name, texts):
+	aliases= bus['cache']['material_alias'].items
+	hashes=  bus['cache']['material_hash']
+
+	kept= re.compile(r'(MC\d\d_)?%s$' % re.escape(ma_name))
+
+	blocks= {}
+	for text in texts:
+		for m in MATERIAL_BLOCK_RE.finditer(text):
+			if token in m.group(2):
+				blocks[m.group(2)]= m
+
+	done= set()
+
+	def resolve(name):
+		if name in done:
+			return
+		done.add(name)
+
+		m= blocks[name]
+		for ref in get_reference_names(m.group(4)):
+			if ref in blocks:
+				resolve(ref)
+
+		if kept.match(name):
+			return
+
+		key= hashlib.sha1(("%s\0%s" % (m.group(1), rewrite_material_aliases(aliases, m.group(4)))).encode('utf-8')).digest()
+
+		canonical= hashes.get(key)
+		if canonical is None:
+			hashes[key]= name
+		elif canonical != name:
+			bus['cache']['material_alias'][name]= canonical
+
+	for name in blocks:
+		resolve(name)
+
+	result=  []
+	dropped= []
+	for text in texts:
+		counts= {}
+		def rewrite_block(m):
+			if m.group(2) in aliases:
+				counts[m.group(1)]= counts.get(m.group(1), 0) + 1
+				return ""
+			return "\n%s %s {%s%s\n}\n" % (m.group(1), m.group(2), m.group(3), rewrite_material_aliases(aliases, m.group(4)))
+		result.append(MATERIAL_BLOCK_RE.sub(rewrite_block, text))
+		dropped.append(counts)
+
+	return result, dropped
+
+
+def write_material(bus):
+	scene= bus['scene']
+
+	if not scene.vray.exporter.use_material_dedup:
+		return _write_material(bus)
+
+	files= bus['files']
+
+	materials_file= files['materials']
+	textures_file=  files['textures']
+
+	files['materials']= ExportFile()
+	files['textures']=  ExportFile()
+	try:
+		ma_name= _write_material(bus)
+		buffers= (files['materials'], files['textures'])
+		texts=   [f.getvalue() for f in buffers]
+	finally:
+		files['materials']= materials_file
+		files['textures']=  textures_file
+
+	token= get_name(bus['material']['material'], prefix='MA')
+
+	texts, dropped= dedup_material_blocks(bus, token, ma_name, texts)
+
+	for ofile,buf,text,counts in zip((materials_file, textures_file), buffers, texts, dropped):
+		ofile.write(text)
+
+		# Keep plugin counts of the written blocks
+		for pluginType,count in buf.plugins.items():
+			count-= counts.get(pluginType, 0)
+			if count > 0:
+				ofile.plugins[pluginType]= ofile.plugins.get(pluginType, 0) + count
+
+	# Textures used by geometry and mesh lights
+	aliases= bus['cache']['material_alias'].items
+	if aliases:
+		for key in bus.get('textures', {}):
+			if type(bus['textures'][key]) is str:
+				bus['textures'][key]= aliases.get(bus['textures'][key], bus['textures'][key])
+		if type(bus['node'].get('displacement_texture')) is str:
+			bus['node']['displacement_texture']= aliases.get(bus['node']['displacement_texture'], bus['node']['displacement_texture'])
+
+	return ma_name
+
+
+def _write_material(bus):
 	scene= bus['scene']
 #	Includer = scene.vray.Includer
 #	if Includer.materials:
@@ -694,7 +993,7 @@ def	write_material(bus):
 	if bus['material']['orco_suffix']:
 		ma_name+= bus['material']['orco_suffix']
 
-	if not append_unique(bus['cache']['materials'], ma_name):
+	if not bus['cache']['materials'].add(ma_name):
 		return ma_name
 
 	# Init wrapper / override / etc
@@ -724,10 +1023,10 @@ def	write_material(bus):
 		# Add bump mapping if needed
 		brdf= PLUGINS['BRDF']['BRDFBump'].write(bus, base_brdf = brdf, use_bump = True)
 
-		ofile.write("\nMtlSingleBRDF %s {"%(complex_material[-1]))
-		ofile.write("\n\tbrdf=%s;" % a(scene, brdf))
-		ofile.write("\n\tallow_negative_colors=1;")
-		ofile.write("\n}\n")
+		ofile.writePlugin('MtlSingleBRDF', complex_material[-1], (
+			('brdf',                  a(scene, brdf)),
+			('allow_negative_colors', "1"),
+		))
 
 	if VRayMaterial.Mtl2Sided.use:
 		base_material= complex_material.pop()
@@ -757,11 +1056,10 @@ def	write_material(bus):
 
 	if VRayMaterial.MtlWrapper.use:
 		base_material= complex_material.pop()
-		ofile.write("\nMtlWrapper %s {"%(complex_material[-1]))
-		ofile.write("\n\tbase_material= %s;"%(base_material))
+		params= [('base_material', base_material)]
 		for param in PLUGINS['MATERIAL']['MtlWrapper'].PARAMS:
-			ofile.write("\n\t%s= %s;"%(param, a(scene,getattr(VRayMaterial.MtlWrapper,param))))
-		ofile.write("\n}\n")
+			params.append((param, a(scene,getattr(VRayMaterial.MtlWrapper,param))))
+		ofile.writePlugin('MtlWrapper', complex_material[-1], params)
 
 	if VRayMaterial.MtlOverride.use:
 		base_mtl= complex_material.pop()
@@ -784,26 +1082,25 @@ def	write_material(bus):
 
 	if VRayMaterial.MtlRenderStats.use:
 		base_mtl= complex_material.pop()
-		ofile.write("\nMtlRenderStats %s {"%(complex_material[-1]))
-		ofile.write("\n\tbase_mtl= %s;"%(base_mtl))
+		params= [('base_mtl', base_mtl)]
 		for param in PLUGINS['MATERIAL']['MtlRenderStats'].PARAMS:
-			ofile.write("\n\t%s= %s;"%(param, a(scene,getattr(VRayMaterial.MtlRenderStats,param))))
-		ofile.write("\n}\n")
+			params.append((param, a(scene,getattr(VRayMaterial.MtlRenderStats,param))))
+		ofile.writePlugin('MtlRenderStats', complex_material[-1], params)
 
 	if VRayMaterial.round_edges:
 		base_mtl= complex_material.pop()
-		ofile.write("\nMtlRoundEdges %s {" % complex_material[-1])
-		ofile.write("\n\tbase_mtl= %s;" % base_mtl)
-		ofile.write("\n\tradius= %.3f;" % VRayMaterial.radius)
-		ofile.write("\n}\n")
+		ofile.writePlugin('MtlRoundEdges', complex_material[-1], (
+			('base_mtl', base_mtl),
+			('radius',   "%.3f" % VRayMaterial.radius),
+		))
 
 	if VRayMaterial.material_id_number:
 		base_mtl= complex_material.pop()
-		ofile.write("\nMtlMaterialID %s {" % complex_material[-1])
-		ofile.write("\n\tbase_mtl= %s;" % base_mtl)
-		ofile.write("\n\tmaterial_id_number= %i;" % VRayMaterial.material_id_number)
-		ofile.write("\n\tmaterial_id_color= %s;" % p(VRayMaterial.material_id_color))
-		ofile.write("\n}\n")
+		ofile.writePlugin('MtlMaterialID', complex_material[-1], (
+			('base_mtl',           base_mtl),
+			('material_id_number', "%i" % VRayMaterial.material_id_number),
+			('material_id_color',  p(VRayMaterial.material_id_color)),
+		))
 
 	return ma_name
 
@@ -1064,19 +1361,13 @@ def write_lamp(bus):
 	ofile.write("\n}\n")
 
 
-def write_node(bus):
-	scene=      bus['scene']
-	ofile=      bus['files']['nodes']
-	ob=         bus['node']['object']
-	visibility= bus['visibility']
-
-	VRayScene= scene.vray
-	SettingsOptions= VRayScene.SettingsOptions
+# Light linking index: lamps with their include / exclude lists.
+# Built once per frame, so nodes don't have to scan all lamps.
+def get_light_linking(scene):
+	lamps=  []
+	linked= set()
+	names=  set()
 
-	# Lights struct proposal for support Lamps inside duplis and particles:
-	#  [{'name': vray lamp name, 'lamp': lamp_pointer}
-	#   {...}]
-	lights= []
 	for lamp in [o for o in scene.objects if o.type == 'LAMP' or o.vray.LightMesh.use]:
 		if lamp.data is None:
 			continue
@@ -1087,22 +1378,71 @@ def write_node(bus):
 			VRayLamp= lamp.vray.LightMesh
 
 		lamp_name= get_name(lamp, prefix='LA')
+		if lamp_name in names:
+			continue
 
 		if not object_on_visible_layers(scene, lamp) or lamp.hide_render:
 			if not scene.vray.SettingsOptions.light_doHiddenLights:
 				continue
 
-		if VRayLamp.use_include_exclude:
-			object_list= generate_object_list(VRayLamp.include_objects, VRayLamp.include_groups)
-			if VRayLamp.include_exclude == 'INCLUDE':
-				if ob in object_list:
-					append_unique(lights, lamp_name)
-			else:
-				if ob not in object_list:
-					append_unique(lights, lamp_name)
+		names.add(lamp_name)
 
+		if VRayLamp.use_include_exclude:
+			object_list= set(generate_object_list(VRayLamp.include_objects, VRayLamp.include_groups))
+			linked|= object_list
+			lamps.append((lamp_name, VRayLamp.include_exclude == 'INCLUDE', object_list))
 		else:
-			append_unique(lights, lamp_name)
+			lamps.append((lamp_name, None, None))
+
+	return {
+		'lamps':   lamps,
+		'linked':  linked,
+		# Lights of objects not mentioned in any include / exclude list
+		'default': [lamp_name for lamp_name, include, object_list in lamps if not include],
+		# Lights of linked objects, filled on request
+		'objects': {},
+	}
+
+
+def get_node_lights(light_linking, ob):
+	if ob not in light_linking['linked']:
+		return light_linking['default']
+
+	lights= light_linking['objects'].get(ob)
+	if lights is None:
+		lights= [lamp_name for lamp_name, include, object_list in light_linking['lamps'] if include is None or include == (ob in object_list)]
+		light_linking['objects'][ob]= lights
+
+	return lights
+
+
+def write_render_stats(bus, name, base_mtl, signature):
+	scene= bus['scene']
+
+	bus['files']['nodes'].writePlugin('MtlRenderStats', name, (
+		('base_mtl',               base_mtl),
+		('visibility',             a(scene, signature[0])),
+		('camera_visibility',      a(scene, signature[1])),
+		('gi_visibility',          a(scene, signature[2])),
+		('reflections_visibility', a(scene, signature[3])),
+		('refractions_visibility', a(scene, signature[4])),
+		('shadows_visibility',     a(scene, signature[5])),
+	))
+
+
+def write_node(bus):
+	scene=      bus['scene']
+	ofile=      bus['files']['nodes']
+	ob=         bus['node']['object']
+	visibility= bus['visibility']
+
+	VRayScene= scene.vray
+	SettingsOptions= VRayScene.SettingsOptions
+
+	if 'light_linking' not in bus:
+		bus['light_linking']= get_light_linking(scene)
+
+	lights= get_node_lights(bus['light_linking'], ob)
 
 	node_name= bus['node']['name']
 	matrix=    bus['node']['matrix']
@@ -1122,17 +1462,27 @@ def write_node(bus):
 	material = base_mtl
 
 	if not VRayScene.RTEngine.enabled and not VRayScene.RTEngine.use_opencl:
-		material = "RS%s" % node_name
-
-		ofile.write("\nMtlRenderStats %s {" % material)
-		ofile.write("\n\tbase_mtl= %s;" % base_mtl)
-		ofile.write("\n\tvisibility= %s;" %             a(scene, (0 if ob in visibility['all'] or bus['node']['visible'] == False else 1)))
-		ofile.write("\n\tcamera_visibility= %s;" %      a(scene, (0 if ob in visibility['camera']  else 1)))
-		ofile.write("\n\tgi_visibility= %s;" %          a(scene, (0 if ob in visibility['gi']      else 1)))
-		ofile.write("\n\treflections_visibility= %s;" % a(scene, (0 if ob in visibility['reflect'] else 1)))
-		ofile.write("\n\trefractions_visibility= %s;" % a(scene, (0 if ob in visibility['refract'] else 1)))
-		ofile.write("\n\tshadows_visibility= %s;" %     a(scene, (0 if ob in visibility['shadows'] else 1)))
-		ofile.write("\n}\n")
+		signature= (
+			0 if ob in visibility['all'] or bus['node']['visible'] == False else 1,
+			0 if ob in visibility['camera']  else 1,
+			0 if ob in visibility['gi']      else 1,
+			0 if ob in visibility['reflect'] else 1,
+			0 if ob in visibility['refract'] else 1,
+			0 if ob in visibility['shadows'] else 1,
+		)
+
+		# Visibility may change between frames, so animated nodes
+		# keep their own wrapper with interpolated values
+		if is_animation_export(scene):
+			material = "RS%s" % node_name
+			write_render_stats(bus, material, base_mtl, signature)
+
+		# Fully visible nodes don't need a wrapper; others share
+		# one wrapper per material and visibility signature
+		elif 0 in signature:
+			material = "RS%s_%s" % (base_mtl, ''.join(["%i" % v for v in signature]))
+			if bus['cache']['renderstats'].add(material):
+				write_render_stats(bus, material, base_mtl, signature)
 
 	if bus['preview'] and ob.name == 'texture':
 		def getPreviewTexture(ob):
@@ -1157,24 +1507,26 @@ def write_node(bus):
 		if tex_name:
 			material = 'MATexPreview'
 			ofile.write("\n// Texture preview material")
-			ofile.write("\nBRDFLight BRDFTexPreview {")
-			ofile.write("\n\tcolor=%s;" % tex_name)
-			ofile.write("\n\tcolorMultiplier=3.0;")
-			ofile.write("\n}\n")
-			ofile.write("\nMtlSingleBRDF %s {" % material)
-			ofile.write("\n\tbrdf=BRDFTexPreview;")
-			ofile.write("\n}\n")
-
-	ofile.write("\nNode %s {" % node_name)
-	ofile.write("\n\tobjectID=%d;" % bus['node'].get('objectID', ob.pass_index))
-	ofile.write("\n\tgeometry=%s;" % bus['node']['geometry'])
-	ofile.write("\n\tmaterial=%s;" % material)
+			ofile.writePlugin('BRDFLight', 'BRDFTexPreview', (
+				('color',           tex_name),
+				('colorMultiplier', "3.0"),
+			))
+			ofile.writePlugin('MtlSingleBRDF', material, (
+				('brdf', 'BRDFTexPreview'),
+			))
+
+	params= [
+		('objectID', "%d" % bus['node'].get('objectID', ob.pass_index)),
+		('geometry', bus['node']['geometry']),
+		('material', material),
+	]
 	if 'particle' in bus['node'] and 'visible' in bus['node']['particle']:
-		ofile.write("\n\tvisible=%s;" % a(scene, bus['node']['particle']['visible']))
-	ofile.write("\n\ttransform=%s;" % a(scene, transform(matrix)))
+		params.append(('visible', a(scene, bus['node']['particle']['visible'])))
+	params.append(('transform', a(scene, transform(matrix))))
 	if not bus['preview']:
-		ofile.write("\n\tlights=List(%s);" % (','.join(lights)))
-	ofile.write("\n}\n")
+		params.append(('lights', "List(%s)" % (','.join(lights))))
+
+	ofile.writePlugin('Node', node_name, params)
 
 
 def write_object(bus):
@@ -1331,6 +1683,64 @@ def _write_object_particles(bus):
 					bus['node']['hair'] = False
 
 
+# Instancer items have no motion blur velocity
+INSTANCER_VELOCITY = "Transform(Matrix(Vector(0,0,0),Vector(0,0,0),Vector(0,0,0)),Vector(0,0,0))"
+
+# Dupli could be written as Instancer item
+# if it has no own duplis or special export
+def is_instanceable(ob):
+	if ob.type not in {'MESH','CURVE','SURFACE','META','FONT'}:
+		return False
+	if ob.dupli_type != 'NONE' or len(ob.particle_systems):
+		return False
+	if ob.vray.LightMesh.use:
+		return False
+	return True
+
+
+# Writes one hidden prototype Node for every (object, material) pair
+# and a single Instancer with all instance transforms
+def write_instancer(bus, ob, instances):
+	scene= bus['scene']
+	ofile= bus['files']['nodes']
+
+	node= bus['node']
+
+	items= []
+	for dup_id, dup_object, dup_matrix, dup_material in instances:
+		prototype_name= get_name(dup_object, prefix='IP')
+		if dup_material:
+			prototype_name+= get_name(dup_material, prefix='MA')
+
+		if bus['cache']['instancer'].add(prototype_name):
+			bus['node']= {
+				'object'    : dup_object,
+				'visible'   : dup_object,
+				'displace'  : {},
+				'meshlight' : {},
+				'base'      : ob,
+				'dupli'     : {'material': dup_material} if dup_material else {},
+				'particle'  : {
+					'name'    : prototype_name,
+					'matrix'  : mathutils.Matrix.Identity(4),
+					'visible' : 0,
+				},
+			}
+			write_object(bus)
+
+		items.append("List(%i,%s,%s,%s)" % (dup_id, transform(dup_matrix), INSTANCER_VELOCITY, prototype_name))
+
+	bus['node']= node
+
+	# Name of the parent dupli if emitter itself is dupli
+	instancer_name= get_name(ob, prefix='IN') + node.get('dupli', {}).get('name', '')
+
+	ofile.writePlugin('Instancer', instancer_name, (
+		('instances', a(scene, "List(%i,%s)" % (get_export_frame(scene), ','.join(items)))),
+		('visible',   1),
+	))
+
+
 def _write_object_dupli(bus):
 	scene = bus['scene']
 	ob    = bus['node']['object']
@@ -1353,7 +1763,20 @@ def _write_object_dupli(bus):
 		if (ob.dupli_type in ('VERTS','FACES','GROUP')) or dupli_from_particles:
 			ob.dupli_list_create(bus['scene'])
 
+			# Instances written with Instancer: [(id, object, matrix, material)]
+			instances= []
+
 			for dup_id,dup_ob in enumerate(ob.dupli_list):
+				dup_material= None
+				if dupli_from_particles:
+					if VRayExporter.random_material:
+						random.seed(dup_id)
+						dup_material= ob.material_slots[random.randint(0,nEmitterMaterials-1)].material
+
+				if VRayExporter.use_instancer and is_instanceable(dup_ob.object):
+					instances.append((dup_id, dup_ob.object, dup_ob.matrix.copy(), dup_material))
+					continue
+
 				parent_dupli= ""
 
 				bus['node']['object']= dup_ob.object
@@ -1375,10 +1798,8 @@ def _write_object_dupli(bus):
 				bus['node']['dupli']['name']=   dup_node_name
 				bus['node']['dupli']['matrix']= dup_node_matrix
 
-				if dupli_from_particles:
-					if VRayExporter.random_material:
-						random.seed(dup_id)
-						bus['node']['dupli']['material'] = ob.material_slots[random.randint(0,nEmitterMaterials-1)].material
+				if dup_material:
+					bus['node']['dupli']['material'] = dup_material
 
 				_write_object(bus)
 
@@ -1387,6 +1808,9 @@ def _write_object_dupli(bus):
 				bus['node']['dupli']=  {}
 				bus['node']['dupli']['name']=   parent_dupli
 
+			if instances:
+				write_instancer(bus, ob, instances)
+
 			ob.dupli_list_clear()
 	except:
 		pass
@@ -1419,6 +1843,11 @@ def writeSceneInclude(bus):
 						continue
 					vrsceneFilelist.append(os.path.join(dirname, filename))
 		
+		if bus['scene'].vray.exporter.debug and VRayObject.sceneAddMaterials:
+			pluginIndex = get_plugin_index()
+			for vrsceneFilepath in vrsceneFilelist:
+				debug(bus['scene'], "SceneInclude: %s: %i materials" % (vrsceneFilepath, len(pluginIndex.getMaterialsNames(vrsceneFilepath))))
+
 		sceneFile.write("\n\tfilepath=\"%s\";" % (";").join(vrsceneFilelist))
 		sceneFile.write("\n\tprefix=\"%s\";" % get_name(ob, prefix='SI'))
 
@@ -1630,6 +2059,7 @@ def write_scene(bus):
 
 	def write_frame(bus, checkAnimated=False):
 		timer= time.clock()
+		frame_time= time.time()
 		scene= bus['scene']
 
 		debug(scene, "Writing frame %i..." % scene.frame_current)
@@ -1640,13 +2070,7 @@ def write_scene(bus):
 		SettingsOptions= VRayScene.SettingsOptions
 
 		# Cache stores already exported data
-		bus['cache']= {}
-		bus['cache']['textures']=  []
-		bus['cache']['materials']= []
-		bus['cache']['displace']=  []
-		bus['cache']['proxy']=     []
-		bus['cache']['bitmap']=    []
-		bus['cache']['uvwgen']=    {}
+		bus['cache']= init_export_cache('textures', 'materials', 'displace', 'proxy', 'bitmap', 'uvwgen', 'instancer', 'renderstats', 'material_hash', 'material_alias')
 
 		# Fake frame for "Camera loop"
 		if VRayExporter.camera_loop:
@@ -1661,47 +2085,71 @@ def write_scene(bus):
 		# Visibility list for "Hide from view" and "Camera loop" features
 		bus['visibility']= get_visibility_lists(bus['camera'])
 
+		# Lamps include / exclude lists
+		bus['light_linking']= get_light_linking(scene)
+
 		# "Hide from view" debug data
 		if VRayExporter.debug:
 			print_dict(scene, "Hide from view", bus['visibility'])
 
 		if not checkAnimated:
-			write_settings(bus)
+			with measure(bus.get('profiler'), 'stage', 'settings'):
+				write_settings(bus)
+
+		# Hair lists don't need any per item Python code and zlib
+		# releases the GIL, so compression runs in parallel threads
+		# while other objects are exported
+		bus['hair_writer']= None
+		bus['hair_jobs']=   []
+		if VRayExporter.use_compression:
+			bus['hair_writer']= ThreadPoolExecutor(max_workers= scene.render.threads)
+
+		# Pending hair jobs are written or dropped and the writer is
+		# shut down even if export of some object fails
+		try:
+			for ob in bus['objects']:
+				if not object_visible(bus, ob):
+					continue
 
-		for ob in bus['objects']:
-			if not object_visible(bus, ob):
-				continue
+				# Check if smth on object is animated
+				if checkAnimated:
+					if not is_animated(ob):
+						continue
 
-			# Check if smth on object is animated
-			if checkAnimated:
-				if not is_animated(ob):
-					continue
+				debug(scene, "{0}: {1:<32}".format(ob.type, color(ob.name, 'green')), VRayExporter.debug)
 
-			debug(scene, "{0}: {1:<32}".format(ob.type, color(ob.name, 'green')), VRayExporter.debug)
+				# Node struct
+				bus['node']= {}
 
-			# Node struct
-			bus['node']= {}
+				# Currently processes object
+				bus['node']['object']= ob
 
-			# Currently processes object
-			bus['node']['object']= ob
+				# Object visibility
+				bus['node']['visible']= ob
 
-			# Object visibility
-			bus['node']['visible']= ob
+				# We will know if object has displace
+				# only after material export
+				bus['node']['displace']= {}
 
-			# We will know if object has displace
-			# only after material export
-			bus['node']['displace']= {}
+				# We will know if object is mesh light
+				# only after material export
+				bus['node']['meshlight']= {}
 
-			# We will know if object is mesh light
-			# only after material export
-			bus['node']['meshlight']= {}
+				# If object has particles or dupli
+				bus['node']['base']= ob
+				bus['node']['dupli']= {}
+				bus['node']['particle']= {}
 
-			# If object has particles or dupli
-			bus['node']['base']= ob
-			bus['node']['dupli']= {}
-			bus['node']['particle']= {}
+				with measure(bus.get('profiler'), 'object', ob.name):
+					_write_object(bus)
 
-			_write_object(bus)
+			if bus['hair_writer']:
+				write_hair_jobs(bus)
+		finally:
+			if bus['hair_writer']:
+				bus['hair_writer'].shutdown(wait=True)
+				bus['hair_writer']= None
+			bus['hair_jobs']= []
 
 		# TODO: Add camera animation detection
 		#
@@ -1720,8 +2168,35 @@ def write_scene(bus):
 			for key in bus['files']:
 				bus['files'][key].write("\n// End of static data\n")
 
+		if VRayExporter.debug:
+			print_export_cache_stats(scene, bus['cache'])
+
+		if bus.get('profiler'):
+			bus['profiler'].add('stage', 'frame', time.time() - frame_time)
+			bus['profiler'].addCaches(bus['cache'])
+
 		debug(scene, "Writing frame {0}... done {1:<64}".format(scene.frame_current, "[%.2f]"%(time.clock() - timer)))
 
+	# Writes frame to memory and passes it through the animation
+	# filter, so only changed parameters get to the files
+	def write_frame_filtered(bus, checkAnimated=False):
+		files= bus['files']
+
+		bus['files']= {}
+		for key in files:
+			bus['files'][key]= ExportFile()
+
+		try:
+			write_frame(bus, checkAnimated)
+		finally:
+			frame_files= bus['files']
+			bus['files']= files
+
+		animation_filter= bus['animation_filter']
+		for key in frame_files:
+			files[key].write(animation_filter.process(frame_files[key].getvalue()))
+			files[key].addPlugins(frame_files[key].plugins, animation_filter.blocksDropped)
+
 	timer= time.clock()
 
 	debug(scene, "Writing scene...")
@@ -1731,16 +2206,22 @@ def write_scene(bus):
 		return False
 
 	if VRayExporter.auto_meshes:
-		write_geometry(bus)
+		with measure(bus.get('profiler'), 'stage', 'geometry'):
+			write_geometry(bus)
 
 	if VRayExporter.animation and VRayExporter.animation_type in {'FULL', 'NOTMESHES'}:
 		# Store current frame
 		selected_frame = scene.frame_current
 
+		_write_frame= write_frame
+		if VRayExporter.use_animation_filter:
+			bus['animation_filter']= AnimationFilter()
+			_write_frame= write_frame_filtered
+
 		# Export full first frame
 		f = scene.frame_start
 		scene.frame_set(f)
-		write_frame(bus)
+		_write_frame(bus)
 		f += scene.frame_step
 
 		# Export the rest of frames checking
@@ -1750,9 +2231,14 @@ def write_scene(bus):
 			if bus['engine'] and bus['engine'].test_break():
 				return
 			scene.frame_set(f)
-			write_frame(bus, checkAnimated=VRayExporter.check_animated)
+			_write_frame(bus, checkAnimated=VRayExporter.check_animated)
 			f += scene.frame_step
 
+		if VRayExporter.use_animation_filter:
+			animation_filter= bus['animation_filter']
+			animation_filter.close()
+			debug(scene, "Animation keys: written %i, skipped unchanged %i" % (animation_filter.keysWritten, animation_filter.keysSkipped))
+
 		# Restore selected frame
 		scene.frame_set(selected_frame)
 	else:
@@ -1775,6 +2261,63 @@ def write_scene(bus):
 	return False # No errors
 
 
+# Rendered material previews; key is a hash of the exported preview scene
+PREVIEW_CACHE      = None
+PREVIEW_CACHE_SIZE = 256 * 1024 * 1024
+
+PREVIEW_FILE_RE = re.compile(r'file="([^"]+)"')
+
+def get_preview_cache():
+	global PREVIEW_CACHE
+	if PREVIEW_CACHE is None:
+		PREVIEW_CACHE= FileCache(get_cache_dir('previews'), PREVIEW_CACHE_SIZE)
+	return PREVIEW_CACHE
+
+
+def get_preview_cache_key(bus, params):
+	key= hashlib.sha1()
+	key.update(' '.join(params).encode('utf-8'))
+
+	filepaths= []
+	for name in sorted(bus['filenames']):
+		if name in ('output', 'output_filename', 'output_loadfile', 'DR'):
+			continue
+		if name == 'geometry':
+			# bus['filenames']['geometry'] is only a base name of the
+			# per thread files; hash the files the scene includes
+			if 'geometry_filepaths' in bus:
+				filepaths.extend(bus['geometry_filepaths'])
+			else:
+				filepaths.append(os.path.join(get_vray_exporter_path(), "preview", "preview_geometry.vrscene"))
+		else:
+			filepaths.append(bus['filenames'][name])
+
+	for filepath in filepaths:
+		if not os.path.isfile(filepath):
+			continue
+		with open(filepath, 'rb') as f:
+			data= f.read()
+		key.update(data)
+
+		# Referenced files (bitmaps, IES) may change on disk
+		for texture_file in PREVIEW_FILE_RE.findall(data.decode('utf-8', 'replace')):
+			try:
+				st= os.stat(texture_file)
+			except OSError:
+				continue
+			key.update(("%s:%i:%f" % (texture_file, st.st_size, st.st_mtime)).encode('utf-8'))
+
+	return key.hexdigest()
+
+
+def store_preview(key, load_file):
+	try:
+		with open(load_file, 'rb') as f:
+			get_preview_cache().put(key, f.read())
+	except OSError:
+		pass
+
+
 def run(bus):
 	scene = bus['scene']
 
@@ -1873,6 +2416,9 @@ def run(bus):
 			params.append('-imgFile=%s' % Quotes(image_file))
 			params.append('-autoclose=1')
 
+	# V-Ray command line without the log window terminal
+	vray_params = list(params)
+
 	if PLATFORM == "linux":
 		if VRayExporter.log_window:
 			LOG_TERMINAL = {
@@ -1912,6 +2458,34 @@ def run(bus):
 	engine = bus['engine']
 
 	params.append('-displaySRGB=%i' % (1 if VRayExporter.display_srgb else 2))
+	vray_params.append(params[-1])
+
+	preview_key = None
+	if bus['preview'] and engine is not None and not bpy.app.background:
+		preview_key = get_preview_cache_key(bus, params)
+		preview_data = get_preview_cache().get(preview_key)
+		if preview_data is not None:
+			with open(load_file, 'wb') as f:
+				f.write(preview_data)
+			load_result(engine, resolution_x, resolution_y, load_file)
+			return
+
+		# Don't cache result of the previous preview if render fails
+		if os.path.exists(load_file):
+			os.remove(load_file)
+
+	# Material preview is rendered with a persistent V-Ray process;
+	# on failure a new process is started as usual
+	if bus['preview'] and engine is not None and not bpy.app.background:
+		server_params = [param for param in vray_params if param != '-autoclose=1']
+		if PreviewServer.render(server_params, bus['filenames']['scene'], load_file, engine.test_break):
+			load_result(engine, resolution_x, resolution_y, load_file)
+			store_preview(preview_key, load_file)
+			return
+		if engine.test_break():
+			return
+		if VRayExporter.debug:
+			debug(scene, "Preview server failed, using separate V-Ray process")
 
 	# If this is a background task, wait until render end
 	# and no VFB is required
@@ -1926,6 +2500,9 @@ def run(bus):
 		if scene.render.use_border:
 			return
 
+		# Preview server uses the same command port
+		PreviewServer.stop()
+
 		proc = VRayProcess()
 		proc.sceneFile = bus['filenames']['scene']
 		proc.imgFile   = image_file
@@ -1985,33 +2562,45 @@ def run(bus):
 				my_timer()
 
 		else:
-			while True:
-				time.sleep(0.25)
+			supervisor = VRaySupervisor(proc.process, feedback=proc, quality=VRayExporter.feedback_quality)
+			supervisor.start()
 
+			proc_finished = False
+			while not proc_finished:
 				if engine.test_break():
 					proc_interrupted = True
 					debug(None, "Process is interrupted by the user")
 					break
 
-				err = proc.recieve_image(feedback_image)
-				if VRayExporter.debug:
-					debug(None, "Recieve image error: %s"%(err))
-				if err is None:
-					load_result(engine, resolution_x, resolution_y, feedback_image)
-
-				if proc.exit_ready:
-					break
-
-				if VRayExporter.use_progress:
-					msg, prog = proc.get_progress()
-					if prog is not None and msg is not None:
-						engine.update_stats("", "V-Ray: %s %.0f%%"%(msg, prog*100.0))
-						engine.update_progress(prog)
-
-				if proc.exit_ready:
-					break
-
+				for event, data in supervisor.getEvents():
+					if event == EVENT_IMAGE:
+						try:
+							with open(feedback_image, 'wb') as f:
+								f.write(data)
+							load_result(engine, resolution_x, resolution_y, feedback_image)
+						except OSError:
+							pass
+
+					elif event == EVENT_PROGRESS:
+						msg, prog = data
+						if prog is not None:
+							engine.update_stats("", "V-Ray: %s %.0f%%"%(msg, prog*100.0))
+							engine.update_progress(prog)
+
+					elif event == EVENT_LINE:
+						if VRayExporter.debug:
+							print(data)
+
+					elif event in {EVENT_FINISHED, EVENT_EXIT}:
+						proc_finished = True
+
+			# Command socket must be free before V-Ray is asked to quit
+			supervisor.stopImages()
 			proc.kill()
+			supervisor.stop()
+
+			if VRayExporter.debug:
+				print_supervisor_timings(scene, supervisor)
 
 			# Load final result image to Blender
 			if image_to_blender and not proc_interrupted:
@@ -2037,23 +2626,36 @@ def run(bus):
 			return
 
 		if engine is not None and (bus['preview'] or image_to_blender) and not scene.render.use_border:
-			while True:
+			supervisor = VRaySupervisor(process)
+			supervisor.start()
+
+			proc_finished = False
+			while not proc_finished:
 				if engine.test_break():
-					try:
-						process.kill()
-					except:
-						pass
+					supervisor.kill()
 					break
 
-				if process.poll() is not None:
-					if not VRayExporter.animation:
-						result= engine.begin_result(0, 0, resolution_x, resolution_y)
-						layer= result.layers[0]
-						layer.load_from_file(load_file)
-						engine.end_result(result)
-					break
+				for event, data in supervisor.getEvents():
+					if event == EVENT_EXIT:
+						proc_finished = True
+
+			if proc_finished:
+				supervisor.stop()
+				if not VRayExporter.animation:
+					result= engine.begin_result(0, 0, resolution_x, resolution_y)
+					layer= result.layers[0]
+					layer.load_from_file(load_file)
+					engine.end_result(result)
+				if preview_key is not None:
+					store_preview(preview_key, load_file)
+
+			if VRayExporter.debug:
+				print_supervisor_timings(scene, supervisor)
 
-				time.sleep(0.1)
+
+def print_supervisor_timings(scene, supervisor):
+	for phase, seconds in supervisor.getTimings():
+		debug(scene, "%s: %.2f s" % (phase, seconds))
 
 
 def close_files(bus):
@@ -2063,11 +2665,57 @@ def close_files(bus):
 		bus['files'][key].close()
 
 
+def get_written(bus):
+	return sum([f.written for f in bus['files'].values() if isinstance(f, ExportFile)])
+
+
+def write_profile(bus):
+	scene=    bus['scene']
+	profiler= bus['profiler']
+
+	if bus.get('filter'):
+		profiler.addCaches(bus['filter'])
+
+	for key in bus['filenames']:
+		if key in ('output', 'output_filename', 'output_loadfile', 'lightmaps', 'DR'):
+			continue
+		if key == 'geometry':
+			if 'geometry_filepaths' in bus:
+				geometry_filepaths= bus['geometry_filepaths']
+			else:
+				# Written by the mesh export operator: skip files left by older exports
+				geometry_filepaths= [filepath for filepath in glob.glob(bus['filenames']['geometry'][:-11] + "_*.vrscene")
+									 if os.path.getmtime(filepath) >= int(profiler.startTime)]
+			for filepath in geometry_filepaths:
+				profiler.addFile(filepath)
+		else:
+			profiler.addFile(bus['filenames'][key])
+
+	report_filepath= os.path.splitext(bus['filenames']['scene'])[0] + "_profile.json"
+	try:
+		profiler.writeReport(report_filepath)
+		debug(scene, "Export profile: %s" % report_filepath)
+	except OSError as e:
+		debug(scene, "Export profile write error: %s" % e, error=True)
+
+	profiler.publish()
+
+
 def export_and_run(bus):
-	err = write_scene(bus)
+	profiler= bus['profiler']
+	if profiler:
+		profiler.patchPlugins(PLUGINS)
+	try:
+		err = write_scene(bus)
+	finally:
+		if profiler:
+			profiler.restore()
 
 	close_files(bus)
 
+	if profiler:
+		write_profile(bus)
+
 	if not err:
 		run(bus)
 
@@ -2106,6 +2754,11 @@ def init_bus(engine, scene, preview = False):
 	# Render engine
 	bus['engine']= engine
 
+	# Export statistics
+	bus['profiler']= None
+	if VRayExporter.use_profiler and not preview:
+		bus['profiler']= ExportProfiler(lambda: get_written(bus))
+
 	return bus
 
 
@@ -26,6 +26,7 @@
 
 
 ''' Python modules  '''
+import array
 import os
 import subprocess
 import tempfile
@@ -44,13 +45,12 @@ from bpy.props import *
 import vb25.render
 import vb25.proxy
 
-from vb25.lib     import VRaySocket
+from vb25.lib.VRaySocket import VRaySocket
 from vb25.utils   import *
 from vb25.plugins import *
 
 from vb25.lib                 import VRayProxy
-from vb25.lib.VRaySceneParser import GetMaterialsNames
-from vb25.lib.VrmatParser     import GetXMLMaterialsNames
+from vb25.lib.FileCache       import FileCache
 
 
 VRAYBLENDER_MENU_ITEM= "V-Ray"
@@ -711,22 +711,40 @@ class VRAY_OT_flip_resolution(bpy.types.Operator):
 
 
 def LoadProxyMeshToObject(ob, filepath, anim_type, anim_offset, anim_speed, anim_frame):
-	meshFile = VRayProxy.MeshFile(filepath)
-
-	err = meshFile.readFile()
-	if err is not None:
+	try:
+		meshData = VRayProxy.PreviewCache.getPreviewMesh(filepath, anim_type, anim_offset, anim_speed, anim_frame)
+	except Exception as e:
+		debug(None, "Error parsing VRayProxy file \"%s\": %s" % (filepath, e), error=True)
 		return "Error parsing VRayProxy file!"
 
-	meshData = meshFile.getPreviewMesh(anim_type, anim_offset, anim_speed, anim_frame)
 	if meshData is None:
 		return "Can't find preview voxel!"
 
 	meshName = bpy.path.clean_name(os.path.basename(filepath))
 
+	vertices = meshData['vertices']
+	faces    = meshData['faces']
+	numFaces = len(faces) // 3
+
+	# Triangles as 'vertices_raw' quads with zero 4th index;
+	# triangles ending with vertex 0 are rotated like from_pydata() does
+	facesRaw = array.array('i', [0]) * (numFaces * 4)
+	facesRaw[0::4] = faces[0::3]
+	facesRaw[1::4] = faces[1::3]
+	facesRaw[2::4] = faces[2::3]
+	for f in [f for f,v in enumerate(faces[2::3]) if v == 0]:
+		facesRaw[4*f:4*f+3] = array.array('i', (0, faces[3*f], faces[3*f+1]))
+
 	# Add new mesh
 	mesh = bpy.data.meshes.new(meshName)
-	mesh.from_pydata(meshData['vertices'], [], meshData['faces'])
-	mesh.update()
+	mesh.vertices.add(len(vertices) // 3)
+	mesh.vertices.foreach_set('co', vertices)
+
+	meshFaces = mesh.tessfaces if 'tessfaces' in dir(mesh) else mesh.faces
+	meshFaces.add(numFaces)
+	meshFaces.foreach_set('vertices_raw', facesRaw)
+
+	mesh.update(calc_edges=True)
 
 	# Replace object's mesh
 	bm = bmesh.new()
@@ -776,11 +794,7 @@ class VRAY_OT_create_proxy(bpy.types.Operator):
 		VRayScene    = sce.vray
 		VRayExporter = VRayScene.exporter
 
-		@TimeIt("Proxy generated in")
-		def _create_proxy(ob):
-			if ob.type in {'LAMP', 'CAMERA', 'ARMATURE', 'LATTICE', 'EMPTY'}:
-				return
-
+		def _get_vrmesh_filepath(ob):
 			GeomMeshFile= ob.data.vray.GeomMeshFile
 
 			vrmesh_filename= GeomMeshFile.filename if GeomMeshFile.filename else clean_string(ob.name)
@@ -789,7 +803,26 @@ class VRAY_OT_create_proxy(bpy.types.Operator):
 			vrmesh_dirpath= bpy.path.abspath(GeomMeshFile.dirpath)
 			if not os.path.exists(vrmesh_dirpath):
 				os.mkdir(vrmesh_dirpath)
-			vrmesh_filepath= os.path.join(vrmesh_dirpath,vrmesh_filename)
+			return os.path.join(vrmesh_dirpath,vrmesh_filename)
+
+		def _get_proxy_frames(ob):
+			GeomMeshFile= ob.data.vray.GeomMeshFile
+			if not GeomMeshFile.animation:
+				return None
+			frame_start= sce.frame_start
+			frame_end= sce.frame_end
+			if GeomMeshFile.animation_range == 'MANUAL':
+				frame_start= GeomMeshFile.frame_start
+				frame_end= GeomMeshFile.frame_end
+			return list(range(frame_start, frame_end+1))
+
+		@TimeIt("Proxies generated in")
+		def _write_proxies(proxies):
+			vb25.proxy.write_vrmesh_files(sce, [(ob, vrmesh_filepath, _get_proxy_frames(ob)) for ob,vrmesh_filepath in proxies])
+
+		@TimeIt("Proxy generated in")
+		def _create_proxy(ob, vrmesh_filepath):
+			GeomMeshFile= ob.data.vray.GeomMeshFile
 
 			if GeomMeshFile.animation:
 				selected_frame= sce.frame_current
@@ -820,6 +853,9 @@ class VRAY_OT_create_proxy(bpy.types.Operator):
 				else:
 					vb25.proxy.generate_proxy(sce,ob,vrmesh_filepath)
 
+		def _attach_proxy(ob, vrmesh_filepath):
+			GeomMeshFile= ob.data.vray.GeomMeshFile
+
 			ob_name= ob.name
 			ob_data_name= ob.data.name
 
@@ -887,10 +923,23 @@ class VRAY_OT_create_proxy(bpy.types.Operator):
 				GeomMeshFile.file= RelPath(vrmesh_filepath)
 
 		if len(bpy.context.selected_objects):
-			for ob in bpy.context.selected_objects:
-				_create_proxy(ob)
+			objects= bpy.context.selected_objects
 		else:
-			_create_proxy(context.object)
+			objects= [context.object]
+
+		proxies= [(ob, _get_vrmesh_filepath(ob)) for ob in objects if ob.type not in {'LAMP', 'CAMERA', 'ARMATURE', 'LATTICE', 'EMPTY'}]
+
+		# Direct writer encodes frames of all objects in one process pool
+		python_proxies= [(ob, vrmesh_filepath) for ob,vrmesh_filepath in proxies if ob.data.vray.GeomMeshFile.writer == 'PYTHON']
+		if python_proxies:
+			_write_proxies(python_proxies)
+
+		for ob,vrmesh_filepath in proxies:
+			if ob.data.vray.GeomMeshFile.writer != 'PYTHON':
+				_create_proxy(ob, vrmesh_filepath)
+
+		for ob,vrmesh_filepath in proxies:
+			_attach_proxy(ob, vrmesh_filepath)
 
 		return {'FINISHED'}
 
@@ -974,6 +1023,20 @@ class VRAY_OT_write_geometry(bpy.types.Operator):
 
 
 
+class VRAY_OT_mesh_cache_clear(bpy.types.Operator):
+	bl_idname      = "vray.mesh_cache_clear"
+	bl_label       = "Clear Mesh Cache"
+	bl_description = "Remove all cached meshes"
+
+	def execute(self, context):
+		VRayExporter = context.scene.vray.exporter
+
+		FileCache(get_cache_dir('meshes'), VRayExporter.mesh_cache_size * 1024 * 1024).clear()
+
+		return {'FINISHED'}
+
+
+
 class VRAY_OT_write_vrscene(bpy.types.Operator):
 	bl_idname      = "vray.write_vrscene"
 	bl_label       = "Export Scene"
@@ -1022,9 +1085,8 @@ class VRAY_OT_terminate(bpy.types.Operator):
 
 	def execute(self, context):
 		s = VRaySocket()
-		s.connect()
-		s.send("stop", result=False)
-		s.send("quit", result=False)
+		s.connect(retries=0)
+		s.send_commands([("stop", False), ("quit", False)])
 		s.disconnect()
 
 		return {'FINISHED'}
@@ -1300,10 +1362,7 @@ class VRayGetMaterialName(bpy.types.Operator):
 		if not os.path.exists(filePath):
 			return {'CANCELLED'}
 
-		if filePath.endswith(".vrscene"):
-			VRayMaterialNameMenu.ma_list = GetMaterialsNames(filePath)
-		else:
-			VRayMaterialNameMenu.ma_list = GetXMLMaterialsNames(filePath)
+		VRayMaterialNameMenu.ma_list = get_plugin_index().getMaterialsNames(filePath)
 
 		bpy.ops.wm.call_menu(name=VRayMaterialNameMenu.bl_idname)
 
@@ -1343,6 +1402,7 @@ def GetRegClasses():
 		VRAY_OT_create_proxy,
 		VRAY_OT_write_scene,
 		VRAY_OT_write_geometry,
+		VRAY_OT_mesh_cache_clear,
 		VRAY_OT_write_vrscene,
 		VRAY_OT_render,
 		VRAY_OT_run,
@@ -112,7 +112,7 @@ def write_texture(bus):
 	scene   = bus['scene']
 	texture = bus['mtex']['texture']
 
-	if not append_unique(bus['cache']['textures'], bus['mtex']['name']):
+	if not bus['cache']['textures'].add(bus['mtex']['name']):
 		if not 'env' in bus['mtex']:
 			if 'material' in bus:
 				bus['material']['normal_uvwgen'] = bus['cache']['uvwgen'].get(bus['mtex']['name'], bus['defaults']['uvwgen'])
@@ -291,7 +291,7 @@ def stack_write_TexLayered(bus, layers):
 
 	tex_name= 'TL%s' % (''.join([l[0] for l in layers[1:]]))
 
-	if not append_unique(bus['cache']['textures'], tex_name):
+	if not bus['cache']['textures'].add(tex_name):
 		return tex_name
 
 	ofile.write("\nTexLayered %s {" % tex_name)
@@ -307,7 +307,7 @@ def stack_write_TexMix(bus, color1, color2, blend_amount):
 
 	tex_name= 'TM%s%s%s' % (color1, color2, blend_amount)
 
-	if not append_unique(bus['cache']['textures'], tex_name):
+	if not bus['cache']['textures'].add(tex_name):
 		return tex_name
 
 	ofile.write("\nTexMix %s {" % tex_name)
@@ -357,7 +357,7 @@ def write_TexOutput(bus, texmap, mapto):
 
 	tex_name = "MAPTO%sTE%s" % (mapto, texmap)
 
-	if not append_unique(bus['cache']['textures'], tex_name):
+	if not bus['cache']['textures'].add(tex_name):
 		return tex_name
 
 	ofile.write("\nTexOutput %s {" % tex_name)
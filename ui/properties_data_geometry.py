@@ -104,6 +104,7 @@ class VRAY_DP_tools(VRayDataPanel, bpy.types.Panel):
 		col.prop(GeomMeshFile, 'filename')
 		col.separator()
 		col.prop(GeomMeshFile, 'mode', text="Attach mode")
+		col.prop(GeomMeshFile, 'writer')
 
 		split= layout.split()
 		col= split.column()
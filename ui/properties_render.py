@@ -34,6 +34,7 @@ from vb25.utils import *
 from vb25.ui.ui import *
 from vb25.plugins import *
 from vb25 import version
+from vb25.lib import ExportProfiler
 
 
 class VRAY_MT_preset_IM(bpy.types.Menu):
@@ -268,6 +269,7 @@ class VRAY_RP_render(VRayRenderPanel, bpy.types.Panel):
 		col.label(text="Options:")
 		if VRayExporter.animation:
 			col.prop(VRayExporter, 'check_animated')
+			col.prop(VRayExporter, 'use_animation_filter')
 		col.prop(VRayExporter, 'draft')
 
 		layout.separator()
@@ -368,11 +370,20 @@ class VRAY_RP_exporter(VRayRenderPanel, bpy.types.Panel):
 		col.prop(ve, 'display')
 		col.prop(ve, 'autoclose')
 		col.prop(ve, 'debug')
+		col.prop(ve, 'use_profiler')
 		if wide_ui:
 			col= split.column()
 		col.label(text="Mesh export:")
 		col.prop(ve, 'mesh_active_layers', text= "Active layers")
 		col.prop(ve, 'use_instances')
+		col.prop(ve, 'use_instancer')
+		col.prop(ve, 'meshExportThreads', text="Threads")
+		col.prop(ve, 'use_compression')
+		col.prop(ve, 'use_mesh_cache')
+		if ve.use_mesh_cache:
+			row= col.row(align=True)
+			row.prop(ve, 'mesh_cache_size', text="Size")
+			row.operator('vray.mesh_cache_clear', text="", icon='X')
 		# col.prop(SettingsOptions, 'geom_displacement')
 		col.prop(ve, 'mesh_debug')
 
@@ -387,6 +398,7 @@ class VRAY_RP_exporter(VRayRenderPanel, bpy.types.Panel):
 			col= split.column()
 		col.prop(ve, 'use_hair')
 		col.prop(ve, 'random_material', text="Randomize Materials")
+		col.prop(ve, 'use_material_dedup')
 
 		layout.separator()
 
@@ -394,10 +406,21 @@ class VRAY_RP_exporter(VRayRenderPanel, bpy.types.Panel):
 		split = layout.split()
 		col = split.column()
 		col.prop(ve, 'use_feedback')
+		sub = col.column()
+		sub.active = ve.use_feedback
+		sub.prop(ve, 'feedback_quality', text="Quality")
 		if wide_ui:
 			col= split.column()
 		col.prop(ve, 'use_progress')
 
+		if ve.use_profiler and ExportProfiler.LastSummary:
+			layout.separator()
+			layout.label(text="Last export:")
+			box= layout.box()
+			col= box.column(align=True)
+			for line in ExportProfiler.LastSummary:
+				col.label(text=line)
+
 		layout.separator()
 
 		layout.label(text="Advanced:")
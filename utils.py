@@ -26,8 +26,11 @@
 
 
 ''' Python modules  '''
+import array
+import binascii
 import filecmp
 import math
+import multiprocessing
 import os
 import platform
 import random
@@ -40,8 +43,11 @@ import subprocess
 import sys
 import time
 import tempfile
+import zlib
 import getpass
 
+from concurrent.futures import ProcessPoolExecutor
+
 
 ''' Blender modules '''
 import bpy
@@ -51,6 +57,8 @@ import mathutils
 import _vray_for_blender
 
 from vb25.plugins import *
+from vb25.lib.ExportFile  import ExportFile
+from vb25.lib.PluginIndex import PluginIndex
 
 PLATFORM= sys.platform
 HOSTNAME= socket.gethostname()
@@ -568,20 +576,30 @@ def p(t):
 
 
 # Animated property
-def a(scene, t):
+# Values are exported with interpolate()
+def is_animation_export(scene):
 	VRayScene    = scene.vray
 	VRayExporter = VRayScene.exporter
 
-	frame = scene.frame_current
+	if VRayScene.RTEngine.enabled:
+		return False
+
+	return VRayExporter.animation or VRayExporter.camera_loop or VRayExporter.use_still_motion_blur
+
+
+# Frame used as the key of exported animated values
+def get_export_frame(scene):
+	VRayExporter = scene.vray.exporter
 
 	if VRayExporter.camera_loop:
-		frame = VRayExporter.customFrame
-	
-	if VRayScene.RTEngine.enabled:
-		return p(t)
+		return VRayExporter.customFrame
 
-	if VRayExporter.animation or VRayExporter.camera_loop or VRayExporter.use_still_motion_blur:
-		return "interpolate((%i,%s))" % (frame, p(t))
+	return scene.frame_current
+
+
+def a(scene, t):
+	if is_animation_export(scene):
+		return "interpolate((%i,%s))" % (get_export_frame(scene), p(t))
 
 	return p(t)
 
@@ -591,9 +609,6 @@ def a(scene, t):
 # TODO: cache results
 #
 def is_animated(ob):
-	print("ob.name", ob.name)
-	print("ob.animation_data",ob.animation_data)
-
 	if ob.animation_data:
 		return True
 
@@ -645,6 +660,29 @@ def HexFormat(value):
     return ''.join(["%02X" % b for b in bytes])
 
 
+# Little-endian bytes of a numeric sequence
+def ArrayBytes(values, typecode='f'):
+	if type(values) is not array.array or values.typecode != typecode:
+		values= array.array(typecode, values)
+	if sys.byteorder != 'little':
+		values= array.array(typecode, values)
+		values.byteswap()
+	return values.tobytes()
+
+
+# Hex list format
+# Encodes the whole sequence at once instead of calling HexFormat() per item
+def HexFormatArray(values, typecode='f'):
+	return binascii.hexlify(ArrayBytes(values, typecode)).decode('ascii').upper()
+
+
+# Compressed hex list format: "ZIPC", size of the original data
+# and hex of the zlib compressed data
+def ZipHexFormatArray(values, typecode='f'):
+	data= ArrayBytes(values, typecode)
+	return "ZIPC%08X%s" % (len(data), binascii.hexlify(zlib.compress(data, 1)).decode('ascii').upper())
+
+
 # Transform matrix string
 def transform(m):
 	if hasattr(_vray_for_blender, 'getTransformHex'):
@@ -676,6 +714,57 @@ def append_unique(array, item):
 	return True
 
 
+# Already exported data with lookup statistics.
+# Works as a set (add) or as a dict (item access, get).
+class ExportCache():
+	def __init__(self, name):
+		self.name=   name
+		self.items=  {}
+		self.hits=   0
+		self.misses= 0
+
+	def __contains__(self, key):
+		if key in self.items:
+			self.hits+= 1
+			return True
+		self.misses+= 1
+		return False
+
+	def __len__(self):
+		return len(self.items)
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __getitem__(self, key):
+		return self.items[key]
+
+	def __setitem__(self, key, value):
+		self.items[key]= value
+
+	def get(self, key, default= None):
+		if key in self:
+			return self.items[key]
+		return default
+
+	# Returns True if key was not in cache
+	def add(self, key, value= None):
+		if key in self:
+			return False
+		self.items[key]= value
+		return True
+
+
+def init_export_cache(*categories):
+	return dict([(category, ExportCache(category)) for category in categories])
+
+
+def print_export_cache_stats(scene, cache):
+	for category in sorted(cache):
+		c= cache[category]
+		debug(scene, "Cache \"%s\": %i items; hits: %i; misses: %i" % (c.name, len(c), c.hits, c.misses))
+
+
 # V-Ray uses UV indexes, Blender uses UV names
 # Here we store UV name->index map
 def get_uv_layer_id(uv_layers, uv_layer_name):
@@ -706,21 +795,21 @@ def get_visibility_lists(camera):
 	VRayCamera= camera.data.vray
 
 	visibility= {
-		'all':     [],
-		'camera':  [],
-		'gi':      [],
-		'reflect': [],
-		'refract': [],
-		'shadows': [],
+		'all':     set(),
+		'camera':  set(),
+		'gi':      set(),
+		'reflect': set(),
+		'refract': set(),
+		'shadows': set(),
 	}
 
 	if VRayCamera.hide_from_view:
 		for hide_type in visibility:
 			if getattr(VRayCamera, 'hf_%s' % hide_type):
 				if getattr(VRayCamera, 'hf_%s_auto' % hide_type):
-					visibility[hide_type]= generate_object_list(group_names_string= 'hf_%s' % camera.name)
+					visibility[hide_type]= set(generate_object_list(group_names_string= 'hf_%s' % camera.name))
 				else:
-					visibility[hide_type]= generate_object_list(getattr(VRayCamera, 'hf_%s_objects' % hide_type), getattr(VRayCamera, 'hf_%s_groups' % hide_type))
+					visibility[hide_type]= set(generate_object_list(getattr(VRayCamera, 'hf_%s_objects' % hide_type), getattr(VRayCamera, 'hf_%s_groups' % hide_type)))
 
 	return visibility
 
@@ -1055,6 +1144,39 @@ def proxy_creator(hq_filepath, vrmesh_filepath, append= False):
 			debug(None, "Proxy Creator not found!", error= True)
 
 
+# Returns directory for persistent exporter caches
+def get_cache_dir(name):
+	return os.path.join(tempfile.gettempdir(), "vrayblender_cache_%s" % get_username(), name)
+
+
+# Process pool for Blender API free encoding jobs or None.
+# Only forked workers are used: they start with all modules loaded and
+# don't touch locks inherited from Blender threads (they only run array,
+# zlib and binascii code). Where the workers would be spawned a new Blender
+# instance is started for each worker, so no pool is used there.
+def get_process_pool(workers):
+	if workers < 2 or not PLATFORM.startswith('linux'):
+		return None
+	try:
+		if sys.version_info >= (3, 7):
+			return ProcessPoolExecutor(max_workers= workers, mp_context= multiprocessing.get_context('fork'))
+		if sys.version_info >= (3, 4) and multiprocessing.get_start_method() != 'fork':
+			return None
+		return ProcessPoolExecutor(max_workers= workers)
+	except (OSError, NotImplementedError, ValueError):
+		return None
+
+
+# Plugin names index of included *.vrscene / *.vrmat files
+PLUGIN_INDEX= None
+
+def get_plugin_index():
+	global PLUGIN_INDEX
+	if PLUGIN_INDEX is None:
+		PLUGIN_INDEX= PluginIndex(get_cache_dir('plugin_index'))
+	return PLUGIN_INDEX
+
+
 def GetUserConfigDir():
 	userConfigDirpath = bpy.utils.user_resource('CONFIG')
 	if not os.path.exists(userConfigDirpath):
@@ -1259,7 +1381,7 @@ def init_files(bus):
 				filepath = os.path.normpath(os.path.join(export_directory, "..", "%s.vrscene" % (export_filename)))
 			else:
 				filepath = os.path.normpath(os.path.join(export_directory, "%s_%s.vrscene" % (export_filename, key)))
-			bus['files'][key] = open(filepath, 'w')
+			bus['files'][key] = ExportFile(open(filepath, 'w'))
 		bus['filenames'][key] = filepath
 
 	# Duplicate "Color mapping" setting to a separate file for correct preview
@@ -1267,7 +1389,7 @@ def init_files(bus):
 	cmFilepath = getColorMappingFilepath()
 	bus['filenames']['colorMapping'] = cmFilepath
 	if not bus['preview']:
-		bus['files']['colorMapping'] = open(cmFilepath, 'w')
+		bus['files']['colorMapping'] = ExportFile(open(cmFilepath, 'w'))
 
 	# Render output dir
 	bus['filenames']['output'] = create_dir(output_filepath, pathOnly=not VRayExporter.auto_save_render)